@@ -1,120 +1,323 @@
 # base_tool.py - 基础工具类
-from PyQt6.QtCore import Qt, QPointF
-from PyQt6.QtGui import QColor, QPen, QPainter, QImage
+from PyQt6.QtCore import Qt, QPointF, QRect, QTimer, QElapsedTimer
+from PyQt6.QtGui import QColor, QPen, QPainter, QImage, QMouseEvent
+import numpy as np
+from functools import lru_cache
 import math
+import weakref
+
+# 常用Qt枚举，避免在鼠标事件热路径上反复解析属性链
+_LEFT = Qt.MouseButton.LeftButton
+_RIGHT = Qt.MouseButton.RightButton
+_CTRL = Qt.KeyboardModifier.ControlModifier
+_SHIFT = Qt.KeyboardModifier.ShiftModifier
+_ESC = Qt.Key.Key_Escape
+
+# mouse_button 取值: None(未按下)、BUTTON_LEFT、BUTTON_RIGHT
+BUTTON_LEFT = 0
+BUTTON_RIGHT = 1
+
+# 约束类型(正方形与圆形约束相同)
+CONSTRAINT_NONE = 0
+CONSTRAINT_SQUARE = 1
+CONSTRAINT_LINE = 2
+
+# 直线约束的8个吸附方向(每45度，即pi/4)单位向量
+_QUARTER_PI = math.pi / 4.0
+_SNAP8 = tuple((math.cos(i * _QUARTER_PI), math.sin(i * _QUARTER_PI)) for i in range(8))
+_SNAP8_ARRAY = np.array(_SNAP8, dtype=np.float64)
+
+
+@lru_cache(maxsize=16)
+def _resolve_color(controller_ref, fg_version, bg_version, use_bg):
+    """按调色板版本缓存绘制颜色 - 任一颜色变化都会产生新的缓存键"""
+    controller = controller_ref()
+    if controller is None:
+        return None
+    if use_bg:
+        return controller.get_current_bg_color()
+    return controller.get_current_fg_color()
+
+
+def _snap_direction(dx, dy):
+    """返回最接近(dx, dy)的45度方向单位向量 - 只需方向时无需开方"""
+    # 与(dx, dy)点积最大的方向即最接近的45度方向
+    return max(_SNAP8, key=lambda u: u[0] * dx + u[1] * dy)
+
+
+def _constrain_point(start_x, start_y, end_x, end_y, kind=CONSTRAINT_SQUARE):
+    """约束终点 - 纯数值函数，不依赖工具实例"""
+    dx = end_x - start_x
+    dy = end_y - start_y
+    
+    if kind == CONSTRAINT_SQUARE:
+        # copysign保留方向，dx/dy为0时按正方向处理
+        adx, ady = abs(dx), abs(dy)
+        m = adx if adx > ady else ady
+        return start_x + math.copysign(m, dx or 1.0), start_y + math.copysign(m, dy or 1.0)
+    elif kind == CONSTRAINT_LINE:
+        ux, uy = _snap_direction(dx, dy)
+        dist = math.hypot(dx, dy)
+        return start_x + dist * ux, start_y + dist * uy
+    
+    return end_x, end_y
+
 
 class BaseTool:
     """基础工具类"""
+    __slots__ = (
+        'controller', 'start_pos', 'end_pos', 'drawing', 'last_point', 'draw_batch_started',
+        # 工具状态
+        'mouse_button', 'is_ctrl_pressed', 'is_shift_pressed', 'is_right_button_during_drag',
+        # 鼠标移动节流
+        '_elapsed', '_last_move_ms', '_move_interval_ms', '_last_move_buttons', '_pending_move', '_move_timer',
+        '_cancel_update_pending',
+        # 笔画路径缓冲
+        '_points_xy', '_n_points',
+        # 属性面板快照的缓存键
+        '_props_key',
+    )
+    
+    # 按键 -> 处理方法名，子类可通过 {**BaseTool._KEY_HANDLERS, ...} 扩展
+    _KEY_HANDLERS = {_ESC: 'cancel'}
+    
     def __init__(self, controller):
         self.controller = controller
         self.start_pos = None
         self.end_pos = None
         self.drawing = False
         self.last_point = None
-        self.draw_batch_started = False
         
-        # 工具状态
-        self.tool_state = {
-            'mouse_button': None,
-            'is_ctrl_pressed': False,
-            'is_shift_pressed': False,
-            'is_right_button_during_drag': False,
-        }
+        # 工具状态 - 与 reset_states 共用同一份初始化
+        BaseTool.reset_states(self)
+        
+        # 鼠标移动节流：间隔内的移动事件合并，只转发最新位置
+        self._elapsed = QElapsedTimer()
+        self._elapsed.start()
+        self._last_move_ms = 0
+        self._move_interval_ms = 7
+        self._last_move_buttons = None
+        self._pending_move = None
+        self._move_timer = QTimer()
+        self._move_timer.setSingleShot(True)
+        self._move_timer.timeout.connect(self._flush_move)
+        
+        # 取消操作时的延迟画布刷新标志
+        self._cancel_update_pending = False
+        
+        # 笔画路径缓冲：连续的(N, 2)坐标数组，容量不足时倍增
+        self._points_xy = np.empty((256, 2), dtype=np.float32)
+        self._n_points = 0
+        
+        # 上次读取属性面板时的(版本号, 是否用背景色)，首次按下时必然读取
+        self._props_key = None
     
     def mouse_press(self, event, image_pos):
         """鼠标按下事件"""
-        if event.button() == Qt.MouseButton.LeftButton:
-            self.tool_state['mouse_button'] = 'left'
-            self.tool_state['is_right_button_during_drag'] = False
-        elif event.button() == Qt.MouseButton.RightButton:
-            self.tool_state['mouse_button'] = 'right'
-            self.tool_state['is_right_button_during_drag'] = True
-        
-        self.tool_state['is_ctrl_pressed'] = (event.modifiers() & Qt.KeyboardModifier.ControlModifier)
-        self.tool_state['is_shift_pressed'] = (event.modifiers() & Qt.KeyboardModifier.ShiftModifier)
+        self._drop_pending_move()
+        
+        button = event.button()
+        if button == _LEFT or button == _RIGHT:
+            is_right = button == _RIGHT
+            self.mouse_button = int(is_right)
+            self.is_right_button_during_drag = is_right
+        
+        mods = event.modifiers()
+        self.is_ctrl_pressed = bool(mods & _CTRL)
+        self.is_shift_pressed = bool(mods & _SHIFT)
         self.draw_batch_started = False
     
     def mouse_move(self, event, image_pos):
-        """鼠标移动事件"""
-        if event.buttons() & Qt.MouseButton.RightButton:
-            self.tool_state['is_right_button_during_drag'] = True
-            self.tool_state['mouse_button'] = 'right'
-        elif event.buttons() & Qt.MouseButton.LeftButton:
-            self.tool_state['is_right_button_during_drag'] = False
-            self.tool_state['mouse_button'] = 'left'
+        """鼠标移动事件 - 节流后转发给 _do_move"""
+        now = self._elapsed.elapsed()
+        buttons = event.buttons()
+        elapsed = now - self._last_move_ms
+        if elapsed < self._move_interval_ms and buttons == self._last_move_buttons:
+            # 事件对象在处理函数返回后会被Qt销毁，需保存副本
+            self._pending_move = (self._copy_mouse_event(event), image_pos)
+            if not self._move_timer.isActive():
+                self._move_timer.start(max(1, self._move_interval_ms - elapsed))
+            return
+        
+        self._pending_move = None
+        self._move_timer.stop()
+        self._last_move_ms = now
+        self._last_move_buttons = buttons
+        self._do_move(event, image_pos)
+    
+    def _drop_pending_move(self):
+        """丢弃被节流合并、尚未转发的移动事件
+        
+        画布开启了鼠标追踪，按下前不久的悬停移动可能仍在等待；它带着按下前的位置和修饰键，
+        按下后再转发会在旧位置绘制并覆盖 ctrl/shift 状态
+        """
+        self._pending_move = None
+        self._move_timer.stop()
+        self._last_move_buttons = None
+    
+    def _flush_move(self):
+        """转发被节流合并的最后一次移动事件"""
+        pending = self._pending_move
+        if pending is None:
+            return
+        self._pending_move = None
+        self._move_timer.stop()
+        self._last_move_ms = self._elapsed.elapsed()
+        self._do_move(*pending)
+    
+    @staticmethod
+    def _copy_mouse_event(event):
+        """复制鼠标事件，供延迟处理使用"""
+        return QMouseEvent(event.type(), event.position(), event.globalPosition(),
+                           event.button(), event.buttons(), event.modifiers())
+    
+    def _do_move(self, event, image_pos):
+        """鼠标移动处理 - 子类重写此方法而不是 mouse_move"""
+        # 长时间拖动时状态基本不变，只在真正变化时写入
+        buttons = event.buttons()
+        if buttons & _RIGHT:
+            if self.mouse_button != BUTTON_RIGHT:
+                self.mouse_button = BUTTON_RIGHT
+            if not self.is_right_button_during_drag:
+                self.is_right_button_during_drag = True
+        elif buttons & _LEFT:
+            if self.mouse_button != BUTTON_LEFT:
+                self.mouse_button = BUTTON_LEFT
+            if self.is_right_button_during_drag:
+                self.is_right_button_during_drag = False
         
-        self.tool_state['is_ctrl_pressed'] = (event.modifiers() & Qt.KeyboardModifier.ControlModifier)
-        self.tool_state['is_shift_pressed'] = (event.modifiers() & Qt.KeyboardModifier.ShiftModifier)
+        mods = event.modifiers()
+        ctrl = bool(mods & _CTRL)
+        if ctrl != self.is_ctrl_pressed:
+            self.is_ctrl_pressed = ctrl
+        shift = bool(mods & _SHIFT)
+        if shift != self.is_shift_pressed:
+            self.is_shift_pressed = shift
     
     def mouse_release(self, event, image_pos):
         """鼠标释放事件"""
-        if event.button() == Qt.MouseButton.LeftButton:
-            self.tool_state['mouse_button'] = 'left'
-        elif event.button() == Qt.MouseButton.RightButton:
-            self.tool_state['mouse_button'] = 'right'
-        self.tool_state['is_right_button_during_drag'] = False
+        # 先处理被合并的最后一次移动，避免丢失笔画末端
+        self._flush_move()
+        
+        button = event.button()
+        if button == _LEFT or button == _RIGHT:
+            self.mouse_button = int(button == _RIGHT)
+        self.is_right_button_during_drag = False
     
     def key_press(self, event):
         """键盘按下事件"""
-        if event.key() == Qt.Key.Key_Escape:
-            self.cancel()
+        name = self._KEY_HANDLERS.get(event.key())
+        if name:
+            getattr(self, name)()
             return True
         return False
     
     def cancel(self):
         """取消当前操作"""
         self.drawing = False
+        self._pending_move = None
+        self._move_timer.stop()
         self.reset_states()
         
-        if hasattr(self.controller, 'temp_pixmap'):
-            self.controller.temp_pixmap = None
-            if self.controller.canvas:
-                self.controller.canvas.update()
+        # Controller 总是定义 temp_pixmap/canvas/status_updated，无需 hasattr 探测
+        controller = self.controller
+        if controller is None:
+            return
+        
+        controller.temp_pixmap = None
+        if controller.canvas and not self._cancel_update_pending:
+            # 延迟到事件循环空闲时刷新，连续取消只刷新一次
+            self._cancel_update_pending = True
+            QTimer.singleShot(0, self._deferred_canvas_update)
         
-        if self.controller and hasattr(self.controller, 'status_updated'):
-            self.controller.status_updated.emit("操作已取消")
+        controller.status_updated.emit("操作已取消")
+    
+    def _deferred_canvas_update(self):
+        """执行 cancel() 调度的画布刷新"""
+        self._cancel_update_pending = False
+        canvas = self.controller.canvas if self.controller else None
+        if canvas:
+            canvas.update()
     
     def reset_states(self):
         """重置工具状态"""
-        self.tool_state = {
-            'mouse_button': None,
-            'is_ctrl_pressed': False,
-            'is_shift_pressed': False,
-            'is_right_button_during_drag': False,
-        }
+        self.mouse_button = None
+        self.is_ctrl_pressed = False
+        self.is_shift_pressed = False
+        self.is_right_button_during_drag = False
         self.draw_batch_started = False
     
     def _get_drawing_color(self):
         """获取绘制颜色"""
-        if self.tool_state['is_right_button_during_drag']:
-            return self.controller.get_current_bg_color()
-        else:
-            button = self.tool_state['mouse_button']
-            if button == 'right':
-                return self.controller.get_current_bg_color()
-            return self.controller.get_current_fg_color()
-    
-    def _apply_constraint(self, start_x, start_y, end_x, end_y, constraint_type='square'):
-        """应用约束(正方形、圆形等)"""
-        if not self.tool_state['is_shift_pressed']:
-            return end_x, end_y
-        
-        dx = end_x - start_x
-        dy = end_y - start_y
-        
-        if constraint_type in ['square', 'circle']:
-            max_dist = max(abs(dx), abs(dy))
-            new_end_x = start_x + (max_dist if dx >= 0 else -max_dist)
-            new_end_y = start_y + (max_dist if dy >= 0 else -max_dist)
-            return new_end_x, new_end_y
-        elif constraint_type == 'line':
-            angle_rad = math.atan2(dy, dx)
-            angle_deg = math.degrees(angle_rad)
-            constrained_angle_deg = round(angle_deg / 45.0) * 45.0
-            constrained_angle_rad = math.radians(constrained_angle_deg)
-            dist = math.sqrt(dx**2 + dy**2)
-            new_end_x = start_x + dist * math.cos(constrained_angle_rad)
-            new_end_y = start_y + dist * math.sin(constrained_angle_rad)
-            return new_end_x, new_end_y
-        
-        return end_x, end_y
\ No newline at end of file
+        controller = self.controller
+        use_bg = self.is_right_button_during_drag or self.mouse_button == BUTTON_RIGHT
+        return _resolve_color(weakref.ref(controller), controller.fg_version, controller.bg_version, use_bg)
+    
+    def _props_changed(self):
+        """自上次调用以来属性面板(大小、不透明度、颜色)或所用的前景/背景色是否改变
+        
+        面板未改变时，按下鼠标可直接沿用上次读取的属性，不必再逐项查询控件
+        """
+        controller = self.controller
+        key = (controller.brush_props_revision, self.is_right_button_during_drag or self.mouse_button == BUTTON_RIGHT)
+        if key == self._props_key:
+            return False
+        self._props_key = key
+        return True
+    
+    @staticmethod
+    def _stroke_rect(start_point, end_point, size):
+        """线段笔画的包围矩形(含笔宽和抗锯齿余量)，用于增量合成"""
+        pad = int(size) // 2 + 2
+        x1, y1 = int(start_point.x()), int(start_point.y())
+        x2, y2 = int(end_point.x()), int(end_point.y())
+        return QRect(min(x1, x2) - pad, min(y1, y2) - pad,
+                     abs(x2 - x1) + 2 * pad + 1, abs(y2 - y1) + 2 * pad + 1)
+    
+    # 应用约束(正方形、圆形等) - 调用方需先检查 is_shift_pressed
+    # 直接绑定模块级纯函数，不经过额外的方法帧
+    _apply_constraint = staticmethod(_constrain_point)
+    
+    # 直线约束的吸附方向(单位向量)，只需方向的调用方可避免计算长度
+    _apply_line_direction = staticmethod(_snap_direction)
+    
+    # ===================== 路径缓冲 =====================
+    
+    def append_point(self, x, y):
+        """向路径缓冲追加一个点"""
+        n = self._n_points
+        if n == len(self._points_xy):
+            grown = np.empty((n * 2, 2), dtype=np.float32)
+            grown[:n] = self._points_xy
+            self._points_xy = grown
+        self._points_xy[n, 0] = x
+        self._points_xy[n, 1] = y
+        self._n_points = n + 1
+    
+    def points_view(self):
+        """返回当前路径的(N, 2)视图(不复制，追加后可能失效)"""
+        return self._points_xy[:self._n_points]
+    
+    def clear_points(self):
+        """清空路径缓冲(保留已分配的容量)"""
+        self._n_points = 0
+    
+    @staticmethod
+    def apply_constraint_batch(points, start_x, start_y, kind=CONSTRAINT_SQUARE):
+        """批量应用约束 - points为(N, 2)坐标数组，返回约束后的新数组
+        
+        用于一次处理整段笔画路径；单点更新仍使用 _apply_constraint，避免数组开销
+        """
+        pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        start = np.array((start_x, start_y), dtype=np.float64)
+        d = pts - start
+        
+        if kind == CONSTRAINT_SQUARE:
+            m = np.abs(d).max(axis=1, keepdims=True)
+            return start + np.where(d >= 0, m, -m)
+        elif kind == CONSTRAINT_LINE:
+            best = _SNAP8_ARRAY[np.argmax(d @ _SNAP8_ARRAY.T, axis=1)]
+            dist = np.hypot(d[:, 0], d[:, 1])[:, None]
+            return start + dist * best
+        
+        return pts.copy()
\ No newline at end of file
@@ -1,12 +1,153 @@
 # controller.py - 完整修复版（含透明色支持和选区工具功能）
-from PyQt6.QtCore import Qt, QObject, pyqtSignal, QPointF, QTimer, QRect
-from PyQt6.QtGui import QColor, QPixmap, QPainter, QImage, QTransform, QPen
+#
+# 图像格式约定：进入图层、选区内容和剪贴板粘贴的图像统一为 Controller.LAYER_FORMAT
+# (ARGB32_Premultiplied)，由 _normalize_image 转换。Qt 只对该格式走SIMD混合快速路径，
+# 合成、绘制时不再需要逐次格式转换。需要非预乘像素的地方(调整、导出)用 _straight_alpha。
+from PyQt6.QtCore import Qt, QObject, pyqtSignal, QPointF, QTimer, QRect, QRunnable, QThreadPool, QElapsedTimer
+from PyQt6.QtGui import QColor, QPixmap, QPixmapCache, QPainter, QImage, QTransform, QPen
 from PyQt6.QtWidgets import QMessageBox, QFileDialog, QListWidgetItem, QApplication, QInputDialog
 from image_processor import ImageProcessor
 from tool_system import ToolManager
-from PIL import Image, ImageOps, ImageEnhance
+from history_tiles import SpillFile, TILE_SIZE
+from history_commands import (LayerPatchCommand, LayerStackCommand, LayerAddCommand,
+                              LayerRemoveCommand, AdjustmentCommand, AdjustmentResetCommand,
+                              BoundedHistory, HistoryTransaction, xor_patches)
+from PIL import Image, ImageOps
+import numpy as np
+import io
 import os
-from collections import deque
+import stat
+import tempfile
+import threading
+
+
+# 工具提示信息
+_TOOL_HINTS = {
+    'brush': "画笔工具 (B键)",
+    'eraser': "橡皮擦工具 (E键)",
+    'airbrush': "喷枪工具 (A键)",
+    'fill': "填充工具 (F键)",
+    'line': "直线工具 (L键)",
+    'rectangle': "矩形工具 (R键, Shift: 正方形, Ctrl: 填充)",
+    'ellipse': "椭圆工具 (O键, Shift: 圆形, Ctrl: 填充)",
+    'star': "多角星工具 (S键)",
+    'polygon': "多边形工具 (P键)",
+    'rounded_rect': "圆角矩形工具 (U键)",
+    'text': "文字工具 (T键, 左键创建, 双击编辑, 右键提交)",
+    'picker': "取色工具 (I键, 左键前景色, 右键背景色)",
+    'rect_select': "矩形选区工具 (M键, Enter提交, Esc取消)",
+    'ellipse_select': "椭圆选区工具",
+    'polygon_select': "多边形选区工具",
+    'curve': "曲线工具 (V键, C键切换封闭/开放, 右键结束)",
+}
+
+# 选区工具ID
+_SELECT_TOOLS = frozenset(('rect_select', 'ellipse_select', 'polygon_select'))
+
+# 滤镜名 -> ImageProcessor 方法名
+_FILTER_METHODS = {
+    "高斯模糊": 'apply_gaussian_blur',
+    "运动模糊": 'apply_motion_blur',
+    "锐化": 'apply_sharpen',
+    "浮雕": 'apply_emboss',
+    "马赛克": 'apply_mosaic',
+}
+
+
+def _decode_image(path):
+    """解码图像文件为RGB/RGBA的PIL图像 - 不访问Qt对象，可在工作线程中调用"""
+    pil_image = Image.open(path)
+    
+    # 处理EXIF方向 - exif_transpose 在无需旋转时也会复制整图，先检查方向标记
+    try:
+        if pil_image.getexif().get(0x0112, 1) != 1:
+            pil_image = ImageOps.exif_transpose(pil_image)
+    except:
+        pass
+    
+    # RGB 可直接写入QImage，其余模式统一转换为 RGBA
+    if pil_image.mode not in ('RGB', 'RGBA'):
+        pil_image = pil_image.convert('RGBA')
+    
+    # Image.open 是惰性的，在工作线程内完成实际解码
+    pil_image.load()
+    return pil_image
+
+
+def _write_image(pil_image, path):
+    """按扩展名转换模式并写入文件 - 不访问Qt对象，可在工作线程中调用"""
+    lower = path.lower()
+    if lower.endswith(('.jpg', '.jpeg')) and pil_image.mode == 'RGBA':
+        # 创建白色背景
+        background = Image.new('RGB', pil_image.size, (255, 255, 255))
+        background.paste(pil_image, mask=pil_image.split()[3])
+        pil_image = background
+    elif lower.endswith('.bmp') and pil_image.mode == 'RGBA':
+        pil_image = pil_image.convert('RGB')
+    
+    # 先编码到内存，再写临时文件并替换，失败时不会留下写了一半的文件
+    fmt = Image.registered_extensions().get(os.path.splitext(lower)[1], 'PNG')
+    buffer = io.BytesIO()
+    pil_image.save(buffer, format=fmt)
+    
+    # 确保目录存在；临时文件名唯一，同时进行的写入不会争用同一个文件
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(buffer.getbuffer())
+        # mkstemp 创建的文件权限为0600，沿用原文件的权限
+        try:
+            os.chmod(temp_path, stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class _IOSignals(QObject):
+    """后台读写任务的完成信号"""
+    finished = pyqtSignal(object, str)  # 结果, 错误信息(成功时为空)
+
+
+class _IOTask(QRunnable):
+    """在线程池中执行文件读写等后台计算 - func 只能处理PIL/numpy数据，不能访问Qt GUI对象
+    
+    token 为 threading.Event，被设置后完成结果会被丢弃
+    """
+    
+    def __init__(self, func, args, token=None):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.func = func
+        self.args = args
+        self.token = token
+        self.signals = _IOSignals()
+        # 完成后保留错误信息: 完成信号排队投递，等待任务结束的一方可直接读取
+        self.error = ""
+        # 任务结束时设置 - 只等待这个任务，不必等待共享线程池中的其他工作
+        self.done = threading.Event()
+    
+    def run(self):
+        try:
+            if self.token is not None and self.token.is_set():
+                self.signals.finished.emit(None, "")
+                return
+            try:
+                result = self.func(*self.args)
+            except Exception as e:
+                self.error = str(e)
+                self.signals.finished.emit(None, self.error)
+                return
+            self.signals.finished.emit(result, "")
+        finally:
+            self.done.set()
 
 
 class Controller(QObject):
@@ -18,7 +159,15 @@ class Controller(QObject):
     DEFAULT_WIDTH = 800
     DEFAULT_HEIGHT = 600
     DEFAULT_BG_COLOR = QColor(0, 0, 0, 0)
-    MAX_HISTORY = 20
+    MAX_HISTORY = 200
+    HISTORY_MAX_BYTES = 512 * 1024 * 1024  # 撤销/重做栈各自的内存上限
+    HISTORY_SPILL_BYTES = 4 * 1024 * 1024 * 1024  # 超出内存上限后转存到磁盘的上限(各栈)
+    HISTORY_MERGE_MS = 250  # 间隔小于此值的连续笔画合并为一条历史记录
+    # 图层统一使用预乘格式，Qt光栅引擎对其有SIMD混合快速路径
+    LAYER_FORMAT = QImage.Format.Format_ARGB32_Premultiplied
+    PIXMAP_CACHE_LIMIT_KB = 65536  # 大画布的合成QPixmap需放得进QPixmapCache
+    STATUS_INTERVAL_MS = 100  # 高频状态栏消息的最短间隔
+    _ADJUSTMENT_NAMES = {'brightness': "亮度", 'contrast': "对比度", 'saturation': "饱和度"}
     
     def __init__(self, main_window):
         super().__init__()
@@ -29,6 +178,7 @@ class Controller(QObject):
         # 图像状态
         self.current_image = None
         self.image_path = None
+        self._edit_serial = 0  # 每次标记为已修改时递增，用于发现某段时间内是否有新的修改
         self.is_modified = False
         
         # 图层管理
@@ -47,21 +197,57 @@ class Controller(QObject):
         self.selection_transform = None  # 保存选区变换状态
         
         # 历史记录
-        self.undo_stack = deque(maxlen=self.MAX_HISTORY)
-        self.redo_stack = deque(maxlen=self.MAX_HISTORY)
+        self._history_spill = SpillFile()  # 撤销/重做栈共用的磁盘转存文件
+        self.undo_stack = BoundedHistory(self.HISTORY_MAX_BYTES, self.MAX_HISTORY,
+                                         self._history_spill, self.HISTORY_SPILL_BYTES)
+        self.redo_stack = BoundedHistory(self.HISTORY_MAX_BYTES, self.MAX_HISTORY,
+                                         self._history_spill, self.HISTORY_SPILL_BYTES)
         self.is_recording = True
+        self._pending_edit = None  # 进行中的图层绘制: [图层索引, {块坐标: (矩形, 绘制前像素数组)}, 开始时间, 可合并]
+        self._last_stroke = None  # 最近一次入栈的笔画命令(可与紧接着的笔画合并)
+        self._last_stroke_ms = 0
+        self._history_clock = QElapsedTimer()
+        self._history_clock.start()
+        self._history_ui_pending = False  # 撤销/重做后的界面刷新已安排
+        
+        # 图层绘制复用同一个QPainter(begin 会重置全部绘制状态)
+        self._scratch_painter = QPainter()
+        self._history_status = ""
+        self._adjust_command = None  # 当前滑块拖动对应的历史命令
         
         # 性能优化
         self._update_timer = QTimer(self)
         self._update_timer.timeout.connect(self._delayed_update)
         self._update_timer.setSingleShot(True)
         self._pending_update = False
+        self._dirty_rect = None  # 待增量合成的区域
+        self._full_update = True  # 需要完整重新合成(图层结构变化等)
+        self._composite_buffer = None  # 复用的合成图像缓冲区
+        
+        # 合成图像的QPixmap缓存 - 内容变化时递增版本号使其失效
+        self._composite_version = 0
+        self._composite_pixmap_key = None
+        self._composite_pixmap_version = -1
+        QPixmapCache.setCacheLimit(max(QPixmapCache.cacheLimit(), self.PIXMAP_CACHE_LIMIT_KB))
         
         # 调整状态
-        self._original_images = {}  # 保存各图层的原始图像
+        self._original_images = {}  # 各图层调整前的像素: 只读的(H, W, 4)非预乘BGRA数组
         self._adjustment_values = {}  # 保存调整值
         self._current_adjustment_type = None  # 当前正在进行的调整类型
         
+        # 滑块信号合并：间隔内的多次变化只重新计算一次
+        self._adjust_timer = QTimer(self)
+        self._adjust_timer.setSingleShot(True)
+        self._adjust_timer.timeout.connect(self._flush_adjustment)
+        
+        # 高频路径上的状态栏消息合并：间隔内只显示最后一条
+        self._pending_status = None
+        self._status_timer = QTimer(self)
+        self._status_timer.setSingleShot(True)
+        self._status_timer.timeout.connect(self._flush_status)
+        # 其他地方直接发出的消息更新，待显示的旧消息作废
+        self.status_updated.connect(self._discard_pending_status)
+        
         # 操作状态
         self._current_operation_saved = False
         
@@ -69,9 +255,21 @@ class Controller(QObject):
         self.text_editing = False
         self.current_text_data = None
         
+        # 后台读写任务(保持引用直到完成)
+        self._io_tasks = set()
+        self._pending_saves = {}  # 后台保存任务 -> 路径
+        self._queued_saves = {}  # 路径 -> 等待上一次保存完成后写入的合成图像快照
+        self._open_token = None  # 正在进行的打开操作的取消标记
+        
         # 透明色支持
         self.transparent_color = QColor(0, 0, 0, 0)
         
+        # 调色板版本号 - 颜色改变时递增，用于工具缓存绘制颜色
+        self.fg_version = 0
+        self.bg_version = 0
+        # 属性面板版本号 - 大小、不透明度或任一颜色改变时递增，工具据此跳过重复读取
+        self.brush_props_revision = 0
+        
         # 临时预览位置
         self.temp_preview_position = None
     
@@ -116,11 +314,11 @@ class Controller(QObject):
             height = self.current_image.height()
         
         if image:
-            layer_image = image.copy()
+            layer_image = self._normalize_image(image)
         else:
-            layer_image = QImage(width, height, QImage.Format.Format_ARGB32)
+            layer_image = QImage(width, height, self.LAYER_FORMAT)
             color = fill_color or self.get_current_bg_color()
-            layer_image.fill(color)
+            layer_image.fill(self._premultiplied_pixel(QColor(color)))
         
         return {
             'name': name,
@@ -130,16 +328,41 @@ class Controller(QObject):
             'locked': False
         }
     
+    def _normalize_image(self, image: QImage) -> QImage:
+        """转换为图层格式
+        
+        格式相同时直接共享：QImage是隐式共享的，任何一方被绘制时才会分离，
+        传入的图像之后被修改也不会影响结果。格式不同时转换本身就会生成新图像
+        """
+        if image.format() == self.LAYER_FORMAT:
+            return QImage(image)
+        return image.convertToFormat(self.LAYER_FORMAT)
+    
+    @staticmethod
+    def _premultiplied_pixel(color):
+        """QColor -> 预乘ARGB32像素值，QImage.fill(int) 直接按该值填充，无需逐像素转换"""
+        a = color.alpha()
+        if a == 255:
+            return color.rgba()
+        if a == 0:
+            return 0
+        r = (color.red() * a + 127) // 255
+        g = (color.green() * a + 127) // 255
+        b = (color.blue() * a + 127) // 255
+        return (a << 24) | (r << 16) | (g << 8) | b
+    
     def add_layer(self, name="图层", fill_color=None, image=None):
         """添加图层"""
-        self.save_to_history()
-        
         layer = self.create_layer(name, fill_color, image)
         if not layer:
             return None
         
+        # 历史只记录新图层的引用，不保存其他图层
+        index = len(self.layers)
+        self._push_command(LayerAddCommand(index, layer, self.active_layer_index, index))
+        
         self.layers.append(layer)
-        self.active_layer_index = len(self.layers) - 1
+        self.active_layer_index = index
         
         self.schedule_update()
         self._update_layer_panel_ui()
@@ -159,8 +382,10 @@ class Controller(QObject):
             self.status_updated.emit("无法删除背景图层")
             return False
         
-        self.save_to_history()
-        self.layers.pop(index)
+        # 进行中的绘制按删除前的图层索引记录
+        self._commit_layer_edit()
+        active_before = self.active_layer_index
+        layer = self.layers.pop(index)
         
         # 更新活动图层索引
         if self.active_layer_index >= len(self.layers):
@@ -168,6 +393,9 @@ class Controller(QObject):
         elif index < self.active_layer_index:
             self.active_layer_index -= 1
         
+        # 被删除的图层由历史命令持有，其他图层不受影响
+        self._push_command(LayerRemoveCommand(index, layer, active_before, self.active_layer_index))
+        
         self.schedule_update()
         self._update_layer_panel_ui()
         
@@ -177,7 +405,7 @@ class Controller(QObject):
         """切换图层可见性"""
         if 0 <= index < len(self.layers):
             if self.layers[index]['visible'] != visible:
-                self.save_to_history()
+                self._save_layer_stack()
                 self.layers[index]['visible'] = visible
                 self.schedule_update()
     
@@ -195,7 +423,7 @@ class Controller(QObject):
         if from_idx == to_idx or from_idx == 0 or to_idx == 0:
             return False
         
-        self.save_to_history()
+        self._save_layer_stack()
         
         layer = self.layers.pop(from_idx)
         self.layers.insert(to_idx, layer)
@@ -225,8 +453,8 @@ class Controller(QObject):
             return self.move_layer(index, index + 1)
         return False
     
-    def update_composite_image(self):
-        """更新合成图像"""
+    def update_composite_image(self, dirty_rect=None):
+        """更新合成图像 - 指定 dirty_rect 时只重新合成该区域"""
         if not self.layers:
             return
         
@@ -234,38 +462,121 @@ class Controller(QObject):
         width = first['image'].width()
         height = first['image'].height()
         
-        composite = QImage(width, height, QImage.Format.Format_ARGB32)
-        composite.fill(QColor(0, 0, 0, 0))
+        # 不透明度为0的图层不影响结果，直接跳过
+        visible = [layer for layer in self.layers if layer['visible'] and layer.get('opacity', 100) > 0]
+        
+        # 单个完全不透明的可见图层：直接共享图层图像(隐式共享)，无需合成
+        if len(visible) == 1 and visible[0].get('opacity', 100) == 100 \
+                and visible[0]['image'].size() == first['image'].size():
+            self.current_image = visible[0]['image']
+            self._force_canvas_update(dirty_rect)
+            return
+        
+        # 增量合成：只在已有的合成图像上重画脏区域
+        if dirty_rect is not None and self.current_image is self._composite_buffer \
+                and self.current_image.size() == first['image'].size():
+            self._composite_region(visible, dirty_rect.intersected(self.current_image.rect()))
+            self._force_canvas_update(dirty_rect)
+            return
+        
+        # 尺寸不变时复用上一帧的合成缓冲区，避免每帧分配整图内存
+        composite = self._composite_buffer
+        if composite is None or composite.width() != width or composite.height() != height:
+            composite = QImage(width, height, self.LAYER_FORMAT)
+            self._composite_buffer = composite
         
+        # 图像贴图不需要抗锯齿；第一层以Source模式直接覆盖，省去清空和混合
         painter = QPainter(composite)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        mode = QPainter.CompositionMode.CompositionMode_Source
+        if not visible or visible[0].get('opacity', 100) != 100:
+            composite.fill(0)
+            mode = QPainter.CompositionMode.CompositionMode_SourceOver
         
-        for layer in self.layers:
-            if layer['visible']:
-                opacity = layer.get('opacity', 100) / 100.0
-                painter.setOpacity(opacity)
-                painter.drawImage(0, 0, layer['image'])
+        for layer in visible:
+            painter.setCompositionMode(mode)
+            painter.setOpacity(layer.get('opacity', 100) / 100.0)
+            painter.drawImage(0, 0, layer['image'])
+            mode = QPainter.CompositionMode.CompositionMode_SourceOver
         
         painter.end()
         self.current_image = composite
         
         self._force_canvas_update()
     
-    def _force_canvas_update(self):
-        """强制画布更新"""
-        if not self.canvas:
+    def _composite_region(self, visible, rect):
+        """在 current_image 上重新合成 rect 区域"""
+        if rect.isEmpty():
             return
         
-        if hasattr(self.canvas, 'pixmap'):
+        painter = QPainter(self.current_image)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+        painter.fillRect(rect, Qt.GlobalColor.transparent)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
+        
+        for layer in visible:
+            painter.setOpacity(layer.get('opacity', 100) / 100.0)
+            painter.drawImage(rect.topLeft(), layer['image'], rect)
+        
+        painter.end()
+    
+    def get_composite_pixmap(self):
+        """获取合成图像的QPixmap - 内容未变化时直接从QPixmapCache取出，不重复转换"""
+        if self.current_image is None:
+            return None
+        
+        if self._composite_pixmap_key is not None and self._composite_pixmap_version == self._composite_version:
+            pixmap = QPixmapCache.find(self._composite_pixmap_key)
+            if pixmap is not None and not pixmap.isNull():
+                return pixmap
+        
+        pixmap = QPixmap.fromImage(self.current_image)
+        if self._composite_pixmap_key is not None:
+            QPixmapCache.remove(self._composite_pixmap_key)
+        self._composite_pixmap_key = QPixmapCache.insert(pixmap)
+        self._composite_pixmap_version = self._composite_version
+        return pixmap
+    
+    def _patch_composite_pixmap(self, dirty_rect):
+        """把 current_image 的 dirty_rect 区域写入缓存的QPixmap，成功返回True"""
+        if self._composite_pixmap_key is None or self._composite_pixmap_version != self._composite_version:
+            return False
+        
+        pixmap = QPixmapCache.find(self._composite_pixmap_key)
+        if pixmap is None or pixmap.size() != self.current_image.size():
+            return False
+        
+        # 先移出缓存，使pixmap成为唯一引用，绘制时不会触发整图分离拷贝
+        QPixmapCache.remove(self._composite_pixmap_key)
+        painter = QPainter(pixmap)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+        painter.drawImage(dirty_rect.topLeft(), self.current_image, dirty_rect)
+        painter.end()
+        self._composite_pixmap_key = QPixmapCache.insert(pixmap)
+        return True
+    
+    def _force_canvas_update(self, dirty_rect=None):
+        """强制画布更新 - 指定 dirty_rect 时只刷新缓存QPixmap中的该区域"""
+        # 画布持有的引用会使缓存的pixmap在绘制时分离，先释放
+        if self.canvas and hasattr(self.canvas, 'pixmap'):
             self.canvas.pixmap = None
         
+        if dirty_rect is None or not self._patch_composite_pixmap(dirty_rect):
+            self._composite_version += 1
+        
+        if not self.canvas:
+            return
+        
         try:
             self.canvas.update()
         except RuntimeError:
             self.canvas = None
     
-    def schedule_update(self):
-        """调度延迟更新"""
+    def schedule_update(self, dirty_rect=None):
+        """调度延迟更新 - dirty_rect 为None时完整合成，否则累积脏区域"""
+        if dirty_rect is None:
+            self._full_update = True
+        elif not self._full_update:
+            self._dirty_rect = dirty_rect if self._dirty_rect is None else self._dirty_rect.united(dirty_rect)
         self._pending_update = True
         if not self._update_timer.isActive():
             self._update_timer.start(16)  # 约60fps
@@ -274,39 +585,100 @@ class Controller(QObject):
         """延迟更新执行"""
         if self._pending_update:
             self._pending_update = False
-            self.update_composite_image()
-    
-    def draw_on_active_layer(self, painter_func, save_history=True, is_batch_start=False, is_batch_end=False):
-        """在活动图层绘制 - 修复:支持批处理参数"""
+            dirty_rect = None if self._full_update else self._dirty_rect
+            self._dirty_rect = None
+            self._full_update = False
+            self.update_composite_image(dirty_rect)
+    
+    def _emit_status(self, text):
+        """合并发送状态栏消息 - 用于拖动、滑块等高频路径，离散事件仍直接 emit"""
+        self._pending_status = text
+        if not self._status_timer.isActive():
+            self._status_timer.start(self.STATUS_INTERVAL_MS)
+    
+    def _flush_status(self):
+        """发出最后一条待显示的状态栏消息"""
+        text = self._pending_status
+        if text is not None:
+            self._pending_status = None
+            self.status_updated.emit(text)
+    
+    def _discard_pending_status(self, text):
+        self._pending_status = None
+    
+    def draw_on_active_layer(self, painter_func, save_history=True, is_batch_start=False, is_batch_end=False,
+                             dirty_rect=None, antialias=True, state_setup=None):
+        """在活动图层绘制 - 修复:支持批处理参数
+        
+        dirty_rect 为绘制内容的包围矩形(图像坐标)，提供时只增量合成该区域；
+        也可以是矩形列表(如折线的各段)，历史只保存各矩形实际覆盖的块
+        antialias 只影响矢量图形的光栅化，纯图像拷贝/像素操作应传 False
+        state_setup(painter) 在 painter_func 之前设置画笔、合成模式等状态，使绘制回调只负责绘制；
+        共享的 painter 每次调用后都会结束，不会在事件之间保持对图层的绘制，状态因此每次重新设置
+        """
+        def paint(image):
+            # 直接在图层图像上绘制，不再每次复制整层：QImage是隐式共享的，
+            # 若图层仍被合成结果等引用，QPainter 会先分离出独立副本
+            painter = self._scratch_painter
+            painter.begin(image)
+            try:
+                if antialias:
+                    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+                if state_setup is not None:
+                    state_setup(painter)
+                painter_func(painter)
+            finally:
+                painter.end()
+        
+        self.modify_active_layer(paint, save_history, is_batch_start, is_batch_end, dirty_rect)
+    
+    def modify_active_layer(self, image_func, save_history=True, is_batch_start=False, is_batch_end=False,
+                            dirty_rect=None):
+        """修改活动图层的像素 - image_func(image) 直接改写图层图像，不创建 QPainter
+        
+        用于颜色替换、区域填充等逐像素操作：通过 ImageProcessor.qimage_array(image, writable=True)
+        写缓冲区(可写视图会先分离隐式共享的副本)；历史、批处理和增量重绘与 draw_on_active_layer 相同
+        """
         if self.active_layer_index < 0 or self.active_layer_index >= len(self.layers):
             return
         
         # 检查图层是否锁定
         if self.layers[self.active_layer_index].get('locked', False):
-            self.status_updated.emit("图层已锁定，无法绘制")
+            # 拖动时每个移动事件都会走到这里，合并状态栏消息
+            self._emit_status("图层已锁定，无法绘制")
             return
         
-        # 只有在批处理开始时或非批处理模式下才保存历史
-        if save_history and (is_batch_start or (not is_batch_start and not is_batch_end)):
-            # 检查是否已经为当前操作保存过历史
-            if not hasattr(self, '_current_operation_saved') or not self._current_operation_saved:
-                self.save_to_history()
+        # 批处理在开始时记录历史，持续到鼠标释放；非批处理的单次绘制自成一条记录
+        single = not is_batch_start and not is_batch_end
+        if save_history:
+            if single:
+                self._begin_layer_edit()
+            elif is_batch_start and not self._current_operation_saved:
+                # 连续拖动的笔画允许与上一笔合并
+                self._begin_layer_edit(mergeable=True)
                 self._current_operation_saved = True
         
-        active_layer = self.layers[self.active_layer_index]
-        temp_image = active_layer['image'].copy()
+        image = self.layers[self.active_layer_index]['image']
+        rects = dirty_rect if isinstance(dirty_rect, list) else [dirty_rect]
         
-        painter = QPainter(temp_image)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-        painter_func(painter)
-        painter.end()
+        # 修改前保存即将被修改的块，撤销时只需恢复这部分像素
+        pending = self._pending_edit
+        if pending is not None and pending[0] == self.active_layer_index:
+            for rect in rects:
+                self._snapshot_edit_tiles(pending[1], image, rect)
         
-        active_layer['image'] = temp_image
-        self.schedule_update()
+        image_func(image)
+        
+        for rect in rects:
+            self.schedule_update(rect)
         self.is_modified = True
         
-        # 如果是批处理结束,重置操作保存标志
+        if save_history and single:
+            self._commit_layer_edit()
+        
+        # 如果是批处理结束,提交历史并重置操作保存标志
         if is_batch_end:
+            self._commit_layer_edit()
             self._current_operation_saved = False
     
     # ===================== 工具相关 =====================
@@ -325,30 +697,11 @@ class Controller(QObject):
                 self.canvas.update()
         
         # 取消选区
-        if tool_id not in ['rect_select', 'ellipse_select', 'polygon_select']:
+        if tool_id not in _SELECT_TOOLS:
             self.clear_selection()
         
         # 工具提示信息
-        hints = {
-            'brush': "画笔工具 (B键)",
-            'eraser': "橡皮擦工具 (E键)",
-            'airbrush': "喷枪工具 (A键)",
-            'fill': "填充工具 (F键)",
-            'line': "直线工具 (L键)",
-            'rectangle': "矩形工具 (R键, Shift: 正方形, Ctrl: 填充)",
-            'ellipse': "椭圆工具 (O键, Shift: 圆形, Ctrl: 填充)",
-            'star': "多角星工具 (S键)",
-            'polygon': "多边形工具 (P键)",
-            'rounded_rect': "圆角矩形工具 (U键)",
-            'text': "文字工具 (T键, 左键创建, 双击编辑, 右键提交)",
-            'picker': "取色工具 (I键, 左键前景色, 右键背景色)",
-            'rect_select': "矩形选区工具 (M键, Enter提交, Esc取消)",
-            'ellipse_select': "椭圆选区工具",
-            'polygon_select': "多边形选区工具",
-            'curve': "曲线工具 (V键, C键切换封闭/开放, 右键结束)",
-        }
-        
-        hint = hints.get(tool_id, f"已切换到: {tool_id}")
+        hint = _TOOL_HINTS.get(tool_id, f"已切换到: {tool_id}")
         self.status_updated.emit(hint)
     
     def on_canvas_mouse_press(self, event, image_pos):
@@ -364,7 +717,7 @@ class Controller(QObject):
                     return
         
         # 检查是否是选区工具且在选区外点击
-        if self.current_tool in ['rect_select', 'ellipse_select', 'polygon_select']:
+        if self.current_tool in _SELECT_TOOLS:
             tool = self.tool_manager.get_tool(self.current_tool)
             if tool and hasattr(tool, 'is_active') and tool.is_active:
                 # 检查是否点击在选区外
@@ -393,9 +746,9 @@ class Controller(QObject):
             if tool:
                 tool.mouse_release(event, image_pos)
         
-        # 鼠标释放时重置操作保存标志
-        if hasattr(self, '_current_operation_saved'):
-            self._current_operation_saved = False
+        # 鼠标释放时提交本次绘制并重置操作保存标志
+        self._commit_layer_edit()
+        self._current_operation_saved = False
     
     def on_key_press(self, event):
         """处理按键事件"""
@@ -413,40 +766,33 @@ class Controller(QObject):
             self.status_updated.emit("没有可应用的图层")
             return
         
-        self.save_to_history()
-        
-        try:
-            active_layer = self.layers[self.active_layer_index]
-            
-            # 保存原始图像
-            if self.active_layer_index not in self._original_images:
-                self._original_images[self.active_layer_index] = active_layer['image'].copy()
-            
-            pil_image = self._qimage_to_pil(active_layer['image'])
-            
-            # 滤镜映射表
-            filters = {
-                "高斯模糊": self.image_processor.apply_gaussian_blur,
-                "运动模糊": self.image_processor.apply_motion_blur,
-                "锐化": self.image_processor.apply_sharpen,
-                "浮雕": self.image_processor.apply_emboss,
-                "马赛克": self.image_processor.apply_mosaic,
-            }
-            
-            method = filters.get(filter_name)
-            if not method:
-                self.status_updated.emit(f"未知滤镜: {filter_name}")
-                return
-            
-            pil_image = method(pil_image)
-            active_layer['image'] = self._pil_to_qimage(pil_image)
-            
-            self.schedule_update()
-            self.is_modified = True
-            self.status_updated.emit(f"已应用滤镜: {filter_name}")
+        # 滤镜生成新的图层图像，历史只需保留旧图像的引用；失败时不记录
+        with self._history_transaction(LayerStackCommand(self._layer_stack_state())) as tx:
+            try:
+                active_layer = self.layers[self.active_layer_index]
+                
+                # 保存原始像素
+                if self.active_layer_index not in self._original_images:
+                    self._original_images[self.active_layer_index] = self._frozen_bgra(active_layer['image'])
+                
+                pil_image = self._qimage_to_pil(active_layer['image'])
+                
+                method_name = _FILTER_METHODS.get(filter_name)
+                method = getattr(self.image_processor, method_name) if method_name else None
+                if not method:
+                    self.status_updated.emit(f"未知滤镜: {filter_name}")
+                    return
+                
+                pil_image = method(pil_image)
+                active_layer['image'] = self._pil_to_qimage(pil_image)
+                tx.commit()
+                
+                self.schedule_update()
+                self.is_modified = True
+                self.status_updated.emit(f"已应用滤镜: {filter_name}")
             
-        except Exception as e:
-            self.status_updated.emit(f"应用滤镜失败: {str(e)}")
+            except Exception as e:
+                self.status_updated.emit(f"应用滤镜失败: {str(e)}")
     
     def _apply_adjustment(self, adj_type, value):
         """应用调整 - 完全修复"""
@@ -454,51 +800,59 @@ class Controller(QObject):
             return
         
         # 如果是新的调整类型,保存历史
-        if adj_type != self._current_adjustment_type:
-            self.save_to_history()
+        if adj_type != self._current_adjustment_type or self._adjust_command is None:
+            # 先应用上一类型尚未计算的调整，图层才是最新结果
+            if self._adjust_timer.isActive():
+                self._adjust_timer.stop()
+                self._flush_adjustment()
             self._current_adjustment_type = adj_type
             
-            # 保存原始图像(如果还没有保存)
-            if self.active_layer_index not in self._original_images:
-                active_layer = self.layers[self.active_layer_index]
-                self._original_images[self.active_layer_index] = active_layer['image'].copy()
-        
-        # 保存调整值
+            # 保存原始像素(如果还没有保存)，之后每次重新计算直接读取，不再转换
+            index = self.active_layer_index
+            had_original = index in self._original_images
+            if not had_original:
+                self._original_images[index] = self._frozen_bgra(self.layers[index]['image'])
+            
+            # 历史只记录调整值和调整前图像的引用(隐式共享，不复制像素)
+            command = AdjustmentCommand(index, adj_type, self._adjustment_values.get(adj_type, 0),
+                                        QImage(self.layers[index]['image']),
+                                        self._original_images[index], had_original)
+            self._push_command(command)
+            self._adjust_command = command
+        
+        # 保存调整值，重新计算推迟到定时器触发时统一进行
         self._adjustment_values[adj_type] = value
+        self._adjust_command.new_value = value
+        if not self._adjust_timer.isActive():
+            self._adjust_timer.start(16)  # 约60fps
+        self._emit_status(f"{self._ADJUSTMENT_NAMES.get(adj_type, adj_type)}: {value}")
+    
+    def _flush_adjustment(self):
+        """按最新的调整值重新计算活动图层"""
+        if not self.layers or not (0 <= self.active_layer_index < len(self.layers)):
+            return
         
         # 从原始图像开始应用所有调整
         active_layer = self.layers[self.active_layer_index]
         
-        # 如果有保存的原始图像,从它开始
-        if self.active_layer_index in self._original_images:
-            pil_image = self._qimage_to_pil(self._original_images[self.active_layer_index])
-        else:
-            pil_image = self._qimage_to_pil(active_layer['image'])
-        
-        # 按顺序应用所有调整
-        if 'brightness' in self._adjustment_values:
-            brightness_value = self._adjustment_values['brightness']
-            if brightness_value != 0:
-                enhancer = ImageEnhance.Brightness(pil_image)
-                factor = 1.0 + brightness_value / 100.0
-                pil_image = enhancer.enhance(factor)
-        
-        if 'contrast' in self._adjustment_values:
-            contrast_value = self._adjustment_values['contrast']
-            if contrast_value != 0:
-                enhancer = ImageEnhance.Contrast(pil_image)
-                factor = 1.0 + contrast_value / 100.0
-                pil_image = enhancer.enhance(factor)
-        
-        if 'saturation' in self._adjustment_values:
-            saturation_value = self._adjustment_values['saturation']
-            if saturation_value != 0:
-                enhancer = ImageEnhance.Color(pil_image)
-                factor = 1.0 + saturation_value / 100.0
-                pil_image = enhancer.enhance(factor)
+        # 如果有保存的原始像素,从它开始
+        src = self._original_images.get(self.active_layer_index)
+        if src is None:
+            src = self._frozen_bgra(active_layer['image'])
+        
+        # 亮度、对比度、饱和度在一次遍历中完成，不再经过PIL
+        values = self._adjustment_values
+        result, dst = self._new_qimage_array(src.shape[1], src.shape[0])
+        self.image_processor.adjust_bgra(
+            src, dst,
+            values.get('brightness', 0),
+            values.get('contrast', 0),
+            values.get('saturation', 0),
+        )
+        result.convertTo(self.LAYER_FORMAT)
         
         # 更新图层图像
-        active_layer['image'] = self._pil_to_qimage(pil_image)
+        active_layer['image'] = result
         self.schedule_update()
         self.is_modified = True
     
@@ -521,12 +875,20 @@ class Controller(QObject):
             self.status_updated.emit("没有可重置的调整")
             return
         
-        self.save_to_history()
+        self._adjust_timer.stop()
         
         active_layer = self.layers[self.active_layer_index]
+        original = self._original_images[self.active_layer_index]
         
-        # 恢复原始图像 - 创建新的QImage实例
-        active_layer['image'] = QImage(self._original_images[self.active_layer_index])
+        # 历史保留当前图像的引用和调整值，不做完整快照
+        self._push_command(AdjustmentResetCommand(
+            self.active_layer_index, QImage(active_layer['image']), original, dict(self._adjustment_values)))
+        
+        # 恢复原始图像 - 由原始像素重建新的QImage实例
+        result, dst = self._new_qimage_array(original.shape[1], original.shape[0])
+        dst[...] = original
+        result.convertTo(self.LAYER_FORMAT)
+        active_layer['image'] = result
         
         # 清除调整状态
         self._adjustment_values.clear()
@@ -539,67 +901,97 @@ class Controller(QObject):
     
     # ===================== 图像转换 =====================
     
+    def _qimage_array(self, qimage: QImage, writable=False):
+        """返回32位QImage像素的(H, W, 4) BGRA视图 - 不复制，qimage需保持存活"""
+        return self.image_processor.qimage_array(qimage, writable)
+    
+    def _straight_alpha(self, qimage: QImage):
+        """转换为非预乘的ARGB32(RGB32布局相同，直接返回)"""
+        if qimage.format() in (QImage.Format.Format_ARGB32, QImage.Format.Format_RGB32):
+            return qimage
+        return qimage.convertToFormat(QImage.Format.Format_ARGB32)
+    
+    def layer_array(self, index, writable=False):
+        """返回图层像素的(H, W, 4)预乘BGRA视图 - 图层数据的NumPy入口
+        
+        图层的QImage本身就是连续的像素缓冲区，直接在其上建立视图，
+        避免经PIL转换的整图拷贝。writable=True 时QImage会先与历史记录
+        等共享者分离，写入不会影响快照。图层图像被替换后视图失效。
+        """
+        if not (0 <= index < len(self.layers)):
+            return None
+        return self._qimage_array(self.layers[index]['image'], writable)
+    
+    def _frozen_bgra(self, qimage: QImage):
+        """复制出只读的(H, W, 4)非预乘BGRA数组 - 不依赖QImage存活，可在历史记录间共享"""
+        source = self._straight_alpha(qimage)
+        bgra = np.array(self._qimage_array(source))
+        bgra.setflags(write=False)
+        return bgra
+    
+    def _new_qimage_array(self, width, height):
+        """新建ARGB32 QImage，返回(图像, 可写的BGRA视图)"""
+        qimage = QImage(width, height, QImage.Format.Format_ARGB32)
+        return qimage, self._qimage_array(qimage, writable=True)
+    
     def _qimage_to_pil(self, qimage: QImage):
         """QImage转PIL"""
         if qimage.isNull():
             return Image.new('RGBA', (1, 1), (0, 0, 0, 0))
         
-        if qimage.format() != QImage.Format.Format_ARGB32:
-            qimage = qimage.convertToFormat(QImage.Format.Format_ARGB32)
-        
-        width = qimage.width()
-        height = qimage.height()
-        bytes_per_line = qimage.bytesPerLine()
-        
-        ptr = qimage.bits()
-        if ptr is None:
-            return Image.new('RGBA', (width, height), (0, 0, 0, 0))
-        
-        ptr.setsize(bytes_per_line * height)
-        buffer = bytes(ptr.asarray())
-        return Image.frombytes('RGBA', (width, height), buffer, 'raw', 'BGRA', bytes_per_line, 1)
+        qimage = self._straight_alpha(qimage)
+        bgra = self._qimage_array(qimage)
+        # BGRA -> RGBA 通道交换只产生一次拷贝
+        return Image.fromarray(bgra[..., [2, 1, 0, 3]])
     
     def _pil_to_qimage(self, pil_image):
         """PIL转QImage"""
         if pil_image is None:
             return QImage(1, 1, QImage.Format.Format_ARGB32)
         
-        if pil_image.mode != 'RGBA':
+        # RGB 直接写入，不必先转换为 RGBA
+        if pil_image.mode not in ('RGB', 'RGBA'):
             pil_image = pil_image.convert('RGBA')
         
         width, height = pil_image.size
-        data = pil_image.tobytes('raw', 'BGRA')
-        qimage = QImage(data, width, height, QImage.Format.Format_ARGB32)
-        return qimage.copy()
-    
-    def _ensure_rgba(self, pil_image):
-        """确保RGBA模式"""
-        if pil_image is None:
-            return Image.new('RGBA', (1, 1), (0, 0, 0, 0))
+        rgb = np.asarray(pil_image)
+        
+        if pil_image.mode == 'RGB':
+            # 不透明图像的预乘与非预乘数据相同，直接以图层格式写入
+            qimage = QImage(width, height, self.LAYER_FORMAT)
+            bgra = self._qimage_array(qimage, writable=True)
+            bgra[..., 3] = 255
+        else:
+            qimage, bgra = self._new_qimage_array(width, height)
+            bgra[..., 3] = rgb[..., 3]
+        
+        # 直接写入新QImage的缓冲区，避免 tobytes + QImage.copy 两次拷贝
+        bgra[..., 0] = rgb[..., 2]
+        bgra[..., 1] = rgb[..., 1]
+        bgra[..., 2] = rgb[..., 0]
         
-        if pil_image.mode in ['P', 'L', 'RGB']:
-            return pil_image.convert('RGBA')
-        return pil_image
+        if qimage.format() != self.LAYER_FORMAT:
+            qimage.convertTo(self.LAYER_FORMAT)
+        return qimage
     
     # ===================== 文件操作 =====================
     
+    @property
+    def is_modified(self):
+        """文档是否有未保存的修改"""
+        return self._is_modified
+    
+    @is_modified.setter
+    def is_modified(self, value):
+        self._is_modified = value
+        if value:
+            self._edit_serial += 1
+    
     def new_file(self):
         """新建文件"""
         # 检查当前文档是否需要保存
-        if self.is_modified:
-            reply = QMessageBox.question(
-                self.main_window, '保存更改',
-                "当前图像已修改,是否保存?",
-                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No | 
-                QMessageBox.StandardButton.Cancel
-            )
-            
-            if reply == QMessageBox.StandardButton.Yes:
-                self.save_file()
-                if self.is_modified:  # 保存失败
-                    return
-            elif reply == QMessageBox.StandardButton.Cancel:
-                return
+        if not self._confirm_and_save_if_dirty():
+            return
         
         self.clear_history()
         
@@ -645,22 +1037,8 @@ class Controller(QObject):
     def open_file(self):
         """打开文件"""
         # 检查当前文档是否需要保存
-        if self.is_modified:
-            reply = QMessageBox.question(
-                self.main_window, '保存更改',
-                "当前图像已修改,是否保存?",
-                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No | 
-                QMessageBox.StandardButton.Cancel
-            )
-            
-            if reply == QMessageBox.StandardButton.Yes:
-                self.save_file()
-                if self.is_modified:  # 保存失败
-                    return
-            elif reply == QMessageBox.StandardButton.Cancel:
-                return
-        
-        self.clear_history()
+        if not self._confirm_and_save_if_dirty():
+            return
         
         file_path, _ = QFileDialog.getOpenFileName(
             self.main_window, "打开图像", "", 
@@ -670,16 +1048,34 @@ class Controller(QObject):
         if not file_path:
             return
         
+        # 再次打开时取消尚未完成的解码
+        if self._open_token is not None:
+            self._open_token.set()
+        self._open_token = threading.Event()
+        
+        self.status_updated.emit(f"正在打开: {file_path}")
+        serial = self._edit_serial
+        self._start_io(_decode_image, (file_path,),
+                       lambda pil_image, error: self._on_file_decoded(file_path, pil_image, error, serial),
+                       self._open_token)
+    
+    def _on_file_decoded(self, file_path, pil_image, error, serial):
+        """后台解码完成(在GUI线程执行) - serial 为开始打开时的修改序号"""
+        self._open_token = None
+        if error:
+            QMessageBox.critical(self.main_window, "错误", f"打开失败: {error}")
+            return
+        
+        # 解码期间当前文档又被修改过: 替换前重新询问，否则这些修改会被直接丢弃
+        if self._edit_serial != serial and not self._confirm_and_save_if_dirty():
+            self.status_updated.emit("已取消打开")
+            return
+        
         try:
-            pil_image = Image.open(file_path)
-            
-            # 处理EXIF方向
-            try:
-                pil_image = ImageOps.exif_transpose(pil_image)
-            except:
-                pass
+            # 新文档载入后旧文档的历史不再有用，立即释放其占用的图像
+            # (取消对话框或解码失败时保留当前文档的历史)
+            self.clear_history()
             
-            pil_image = self._ensure_rgba(pil_image)
             self.current_image = self._pil_to_qimage(pil_image)
             self.image_path = file_path
             self.is_modified = False
@@ -713,7 +1109,7 @@ class Controller(QObject):
                 self.canvas.update()
             
             self.status_updated.emit(f"已打开: {file_path}")
-            
+        
         except Exception as e:
             QMessageBox.critical(self.main_window, "错误", f"打开失败: {str(e)}")
     
@@ -726,24 +1122,21 @@ class Controller(QObject):
             self.save_file_as()
             return
         
-        try:
-            # 保存当前视图（包括所有图层）
-            composite = self._qimage_to_pil(self.current_image)
-            
-            # 确保目录存在
-            os.makedirs(os.path.dirname(os.path.abspath(self.image_path)), exist_ok=True)
-            
-            composite.save(self.image_path)
-            self.is_modified = False
-            self.status_updated.emit(f"已保存: {self.image_path}")
-        except Exception as e:
-            QMessageBox.critical(self.main_window, "错误", f"保存失败: {str(e)}")
+        # 保存当前视图（包括所有图层）
+        self._save_in_background(self.image_path)
     
     def save_file_as(self):
         """另存为"""
         if not self.current_image:
             return
         
+        path = self._ask_save_path()
+        if path:
+            self.image_path = path
+            self._save_in_background(path)
+    
+    def _ask_save_path(self):
+        """弹出另存为对话框，返回补全扩展名的路径，取消时返回 None"""
         # 获取默认文件名
         default_name = "未命名.png"
         if self.image_path:
@@ -755,7 +1148,7 @@ class Controller(QObject):
         )
         
         if not path:
-            return
+            return None
         
         # 确保文件扩展名
         if not path.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
@@ -765,208 +1158,332 @@ class Controller(QObject):
                 path += '.bmp'
             else:
                 path += '.png'
+        return path
+    
+    def _save_now(self, path):
+        """在GUI线程同步保存，返回是否成功 - 用于随后就要替换或关闭文档的场合
+        
+        只有写入成功后才清除修改标记；失败时文档保持不变
+        """
+        # 先等待同一文档尚未完成的后台保存，避免两次写入争用同一个临时文件
+        self.wait_for_pending_saves()
+        try:
+            _write_image(self._qimage_to_pil(self.current_image), path)
+        except Exception as e:
+            QMessageBox.critical(self.main_window, "错误", f"保存失败: {str(e)}")
+            return False
         
+        self.image_path = path
+        self.is_modified = False
+        self.status_updated.emit(f"已保存: {path}")
+        return True
+    
+    def _save_in_background(self, path):
+        """在GUI线程取出合成图像快照，编码和磁盘写入交给线程池"""
         try:
             composite = self._qimage_to_pil(self.current_image)
-            
-            # 格式转换
-            if path.lower().endswith(('.jpg', '.jpeg')):
-                if composite.mode == 'RGBA':
-                    # 创建白色背景
-                    background = Image.new('RGB', composite.size, (255, 255, 255))
-                    background.paste(composite, mask=composite.split()[3] if composite.mode == 'RGBA' else None)
-                    composite = background
-            
-            elif path.lower().endswith('.bmp'):
-                if composite.mode == 'RGBA':
-                    composite = composite.convert('RGB')
-            
-            # 确保目录存在
-            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
-            
-            composite.save(path)
-            
-            self.image_path = path
-            self.is_modified = False
-            self.status_updated.emit(f"已保存为: {path}")
-            
         except Exception as e:
             QMessageBox.critical(self.main_window, "错误", f"保存失败: {str(e)}")
+            return
+        
+        # 快照已取出，之后的修改会重新标记为已修改
+        self.is_modified = False
+        if path in self._pending_saves.values():
+            # 同一路径的保存依次执行，只保留最新的快照
+            self._queued_saves[path] = composite
+            self.status_updated.emit(f"等待上次保存完成: {path}")
+            return
+        self._start_save(composite, path)
+    
+    def _start_save(self, composite, path):
+        """启动后台写入任务"""
+        self.status_updated.emit(f"正在保存: {path}")
+        task = self._start_io(_write_image, (composite, path),
+                              lambda result, error: self._on_save_finished(path, error))
+        self._pending_saves[task] = path
+    
+    def _start_io(self, func, args, on_done, token=None):
+        """把文件读写交给线程池，完成后在GUI线程调用 on_done(结果, 错误信息)，返回任务"""
+        task = _IOTask(func, args, token)
+        task.signals.finished.connect(
+            lambda result, error, task=task: self._on_io_finished(task, result, error, on_done))
+        self._io_tasks.add(task)
+        QThreadPool.globalInstance().start(task)
+        return task
+    
+    def run_in_background(self, func, args, on_done):
+        """供工具使用: 在线程池中执行只处理numpy数据的计算，完成后在GUI线程调用 on_done(结果, 错误信息)"""
+        self._start_io(func, args, on_done)
+    
+    def _on_io_finished(self, task, result, error, on_done):
+        """后台任务完成 - 已取消或已由 wait_for_pending_saves 处理的任务直接丢弃结果"""
+        if task not in self._io_tasks:
+            return
+        self._io_tasks.discard(task)
+        self._pending_saves.pop(task, None)
+        if task.token is not None and task.token.is_set():
+            return
+        on_done(result, error)
+    
+    def _on_save_finished(self, path, error):
+        """后台保存完成(在GUI线程执行) - 同一路径有排队的保存时接着写入"""
+        composite = self._queued_saves.pop(path, None)
+        if error:
+            # 文档已重新标记为已修改，排队的快照不再写入
+            self.is_modified = True
+            QMessageBox.critical(self.main_window, "错误", f"保存失败: {error}")
+        elif composite is not None:
+            self._start_save(composite, path)
+        else:
+            self.status_updated.emit(f"已保存: {path}")
+    
+    def has_pending_saves(self):
+        """是否有尚未完成的后台保存"""
+        return bool(self._pending_saves)
+    
+    def wait_for_pending_saves(self):
+        """等待本文档的后台保存完成，并取消尚未完成的打开操作；有保存失败时返回False
+        
+        只等待 _pending_saves 中的任务，线程池中其他文档的任务和工具的计算不会阻塞界面。
+        完成信号是排队投递的，此时还未处理：直接读取任务的结果，
+        使失败在文档关闭之前报告并恢复修改标记
+        """
+        if self._open_token is not None:
+            self._open_token.set()
+        
+        ok = True
+        while self._pending_saves:
+            # 处理完成结果时可能启动同一路径排队的保存，循环直到全部写完
+            task, path = next(iter(self._pending_saves.items()))
+            task.done.wait()
+            self._io_tasks.discard(task)
+            del self._pending_saves[task]
+            self._on_save_finished(path, task.error)
+            ok = ok and not task.error
+        return ok
+    
+    def _confirm_and_save_if_dirty(self):
+        """未修改时直接返回True；否则询问是否保存，返回是否可以继续"""
+        if not self.is_modified:
+            return True
+        
+        reply = QMessageBox.question(
+            self.main_window, '保存更改',
+            "当前图像已修改,是否保存?",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No | 
+            QMessageBox.StandardButton.Cancel
+        )
+        
+        if reply == QMessageBox.StandardButton.Yes:
+            # 之后文档会被替换或关闭，必须确认写入成功: 同步保存，失败或取消另存为时不继续
+            path = self.image_path or self._ask_save_path()
+            return bool(path) and self._save_now(path)
+        return reply != QMessageBox.StandardButton.Cancel
     
     # ===================== 历史记录 =====================
     
-    def save_to_history(self):
-        """✅ 修复核心：保存完整快照，不比较状态"""
-        if not self.is_recording or not self.layers:
+    def _history_transaction(self, command):
+        """在操作修改图层之前创建事务"""
+        # 进行中的绘制先单独记录，之后的修改不会混入它的差分
+        self._commit_layer_edit()
+        return HistoryTransaction(self, command)
+    
+    def _push_command(self, command):
+        """把历史命令压入撤销栈"""
+        if not self.is_recording:
             return
         
-        # ✅ 修复：删除状态比较逻辑，确保每次操作都保存到历史
-        state = []
-        for layer in self.layers:
-            state.append({
-                'name': layer['name'],
-                'image': layer['image'].copy(),  # 关键：确保独立副本
-                'visible': layer['visible'],
-                'opacity': layer['opacity'],
-                'locked': layer.get('locked', False)
-            })
-        
-        # 保存调整状态
-        adjustments = {
-            'original_images': {idx: img.copy() for idx, img in self._original_images.items()},
-            'adjustment_values': dict(self._adjustment_values),
-            'current_adjustment_type': self._current_adjustment_type
-        }
-        
-        self.undo_stack.append({
-            'layers': state,
-            'active': self.active_layer_index,
-            'adjustments': adjustments
-        })
+        # 进行中的绘制先成为一条独立记录，保证命令顺序与操作顺序一致
+        self._commit_layer_edit()
+        # 之后的滑块调整和笔画需要新的命令
+        self._adjust_command = None
+        self._last_stroke = None
         
+        self._report_evicted(self.undo_stack.append(command))
         self.redo_stack.clear()
         self._update_undo_redo_buttons()
     
-    def undo(self):
-        """撤销 - 修复调整的撤销"""
-        if not self.undo_stack:
-            self.status_updated.emit("没有可撤销的操作")
+    def _report_evicted(self, evicted):
+        if evicted:
+            self._emit_status(f"历史记录超出上限，已丢弃最早的 {evicted} 条")
+    
+    def set_history_budget(self, max_mb):
+        """设置撤销/重做栈的内存上限(MB)，超出的最早记录立即转存或丢弃"""
+        max_bytes = int(max_mb) * 1024 * 1024
+        evicted = 0
+        for stack in (self.undo_stack, self.redo_stack):
+            stack.max_bytes = max_bytes
+            evicted += stack.trim()
+        self._report_evicted(evicted)
+        self._update_undo_redo_buttons()
+    
+    def _save_layer_stack(self):
+        """记录图层列表变化前的状态"""
+        self._push_command(LayerStackCommand(self._layer_stack_state()))
+    
+    def _layer_stack_state(self):
+        """图层列表状态 - 图像为隐式共享的浅拷贝，之后的绘制会自动分离"""
+        layers = [{**layer, 'image': QImage(layer['image'])} for layer in self.layers]
+        return layers, self.active_layer_index
+    
+    def _restore_layer_stack(self, state):
+        layers, active = state
+        self.layers[:] = [{**layer, 'image': QImage(layer['image'])} for layer in layers]
+        self.active_layer_index = active
+    
+    def _begin_layer_edit(self, mergeable=False):
+        """开始记录活动图层的一次绘制"""
+        if not self.is_recording:
             return
         
-        # 保存当前状态到重做栈
-        current = []
-        for layer in self.layers:
-            current.append({
-                'name': layer['name'],
-                'image': layer['image'].copy(),
-                'visible': layer['visible'],
-                'opacity': layer['opacity'],
-                'locked': layer.get('locked', False)
-            })
-        
-        # 保存调整状态
-        current_adjustments = {
-            'original_images': {idx: img.copy() for idx, img in self._original_images.items()},
-            'adjustment_values': dict(self._adjustment_values),
-            'current_adjustment_type': self._current_adjustment_type
-        }
-        
-        self.redo_stack.append({
-            'layers': current,
-            'active': self.active_layer_index,
-            'adjustments': current_adjustments
-        })
+        self._commit_layer_edit()
+        self._pending_edit = [self.active_layer_index, {}, self._history_clock.elapsed(), mergeable]
+    
+    def _snapshot_region(self, image, rect):
+        """复制图像的一个区域 - 只分配 rect 大小的内存，返回(矩形, (H, W, 4)数组)"""
+        x, y = rect.x(), rect.y()
+        return rect, np.array(self._qimage_array(image)[y:y + rect.height(), x:x + rect.width()])
+    
+    def _snapshot_edit_tiles(self, tiles, image, rect):
+        """按 TILE_SIZE 网格保存 rect 覆盖的、本次操作中尚未保存过的块
         
-        # 恢复历史状态
-        data = self.undo_stack.pop()
-        self._restore_history(data)
+        rect 为 None 时整个图层都可能被修改
+        """
+        bounds = image.rect()
+        rect = bounds if rect is None else rect.intersected(bounds)
+        if rect.isEmpty():
+            return
         
-        self.is_modified = True
-        self.status_updated.emit(f"撤销 (剩余: {len(self.undo_stack)})")
-        self._update_undo_redo_buttons()
-        self._update_layer_panel_ui()
+        for ty in range(rect.top() // TILE_SIZE, rect.bottom() // TILE_SIZE + 1):
+            for tx in range(rect.left() // TILE_SIZE, rect.right() // TILE_SIZE + 1):
+                if (tx, ty) not in tiles:
+                    tile_rect = QRect(tx * TILE_SIZE, ty * TILE_SIZE, TILE_SIZE, TILE_SIZE).intersected(bounds)
+                    tiles[(tx, ty)] = self._snapshot_region(image, tile_rect)
     
-    def redo(self):
-        """重做 - 修复调整的重做"""
-        if not self.redo_stack:
-            self.status_updated.emit("没有可重做的操作")
+    def _commit_layer_edit(self):
+        """结束当前绘制，把被修改块的异或差分压入撤销栈"""
+        pending = self._pending_edit
+        if pending is None:
             return
         
-        # 保存当前状态到撤销栈
-        current = []
-        for layer in self.layers:
-            current.append({
-                'name': layer['name'],
-                'image': layer['image'].copy(),
-                'visible': layer['visible'],
-                'opacity': layer['opacity'],
-                'locked': layer.get('locked', False)
-            })
-        
-        # 保存调整状态
-        current_adjustments = {
-            'original_images': {idx: img.copy() for idx, img in self._original_images.items()},
-            'adjustment_values': dict(self._adjustment_values),
-            'current_adjustment_type': self._current_adjustment_type
-        }
+        self._pending_edit = None
+        index, tiles, started_ms, mergeable = pending
+        if not tiles or index >= len(self.layers):
+            return
         
-        self.undo_stack.append({
-            'layers': current,
-            'active': self.active_layer_index,
-            'adjustments': current_adjustments
-        })
+        patches = xor_patches(self.layers[index]['image'], tiles.values())
+        if not patches:
+            return
         
-        # 恢复重做状态
-        data = self.redo_stack.pop()
-        self._restore_history(data)
+        command = LayerPatchCommand(index, patches)
+        now = self._history_clock.elapsed()
+        
+        # 上一笔结束后很快又开始的笔画并入上一条记录，避免快速点画产生大量微小记录
+        last = self._last_stroke
+        if mergeable and last is not None and self.undo_stack.peek() is last \
+                and started_ms - self._last_stroke_ms < self.HISTORY_MERGE_MS and last.merge(command):
+            self._report_evicted(self.undo_stack.refresh_top())
+            self.redo_stack.clear()
+            self._last_stroke_ms = now
+            return
+        
+        self._push_command(command)
+        if mergeable:
+            self._last_stroke = command
+            self._last_stroke_ms = now
+    
+    def _settle_history(self):
+        """撤销/重做前完成进行中的绘制和尚未计算的调整"""
+        self._commit_layer_edit()
+        if self._adjust_timer.isActive():
+            self._adjust_timer.stop()
+            self._flush_adjustment()
+    
+    def _after_history_step(self, command):
+        """撤销/重做一条命令后的公共处理"""
+        # 撤销/重做后的滑块调整需要新的命令
+        self._adjust_command = None
+        self._current_adjustment_type = None
+        
+        # 清除临时预览和选区 - 画布随 schedule_update 一起刷新
+        self.temp_pixmap = None
+        self._reset_selection_state()
         
         self.is_modified = True
-        self.status_updated.emit(f"重做 (剩余: {len(self.redo_stack)})")
+        self.schedule_update(command.dirty_rect)
+        
+        # 按住 Ctrl+Z 连续撤销时，面板、按钮和状态栏只在这一串操作结束后刷新一次
+        if not self._history_ui_pending:
+            self._history_ui_pending = True
+            QTimer.singleShot(0, self._flush_history_ui)
+    
+    def _flush_history_ui(self):
+        """刷新撤销/重做后的界面(一串连续撤销/重做只执行一次)"""
+        self._history_ui_pending = False
         self._update_undo_redo_buttons()
         self._update_layer_panel_ui()
+        self.status_updated.emit(self._history_status)
     
-    def _restore_history(self, data):
-        """✅ 修复核心：重建所有对象，避免引用污染"""
-        self.is_recording = False
-        
-        self.layers.clear()
-        for state in data['layers']:
-            layer = {
-                'name': state['name'],
-                'image': QImage(state['image']),  # ✅ 修复：创建新的QImage实例
-                'visible': state['visible'],
-                'opacity': state['opacity'],
-                'locked': state.get('locked', False)
-            }
-            self.layers.append(layer)
-        
-        self.active_layer_index = data['active']
-        
-        # 恢复调整状态
-        if 'adjustments' in data:
-            adj_data = data['adjustments']
-            # ✅ 修复：创建新的QImage实例
-            self._original_images = {idx: QImage(img) for idx, img in adj_data.get('original_images', {}).items()}
-            self._adjustment_values = dict(adj_data.get('adjustment_values', {}))
-            self._current_adjustment_type = adj_data.get('current_adjustment_type')
-        else:
-            # 清除调整状态
-            self._original_images.clear()
-            self._adjustment_values.clear()
-            self._current_adjustment_type = None
+    def undo(self):
+        """撤销 - 按命令撤销，只恢复该操作改变的内容"""
+        self._settle_history()
+        if not self.undo_stack:
+            self.status_updated.emit("没有可撤销的操作")
+            return
         
-        # 清除临时预览
-        if hasattr(self, 'temp_pixmap'):
-            self.temp_pixmap = None
+        command = self.undo_stack.pop()
+        command.revert(self)
+        self._report_evicted(self.redo_stack.append(command))
         
-        # 清除选区
-        self.clear_selection()
+        self._history_status = f"撤销 (剩余: {len(self.undo_stack)})"
+        self._after_history_step(command)
+    
+    def redo(self):
+        """重做 - 重新执行被撤销的命令"""
+        self._settle_history()
+        if not self.redo_stack:
+            self.status_updated.emit("没有可重做的操作")
+            return
         
-        self._update_layer_panel_ui()
-        self.schedule_update()
+        command = self.redo_stack.pop()
+        command.apply(self)
+        self._report_evicted(self.undo_stack.append(command))
         
-        self.is_recording = True
+        self._history_status = f"重做 (剩余: {len(self.redo_stack)})"
+        self._after_history_step(command)
     
     def _update_undo_redo_buttons(self):
         """更新撤销/重做按钮状态"""
         if not self.main_window:
             return
         
-        # 在主窗口工具栏中查找并更新按钮状态
-        if hasattr(self.main_window, 'top_toolbar'):
-            for action in self.main_window.top_toolbar.actions():
-                if action.text() == "撤销":
-                    action.setEnabled(len(self.undo_stack) > 0)
-                elif action.text() == "重做":
-                    action.setEnabled(len(self.redo_stack) > 0)
+        # 主窗口创建工具栏时记下了这两个按钮
+        undo_action = getattr(self.main_window, 'undo_toolbar_action', None)
+        if undo_action is not None:
+            undo_action.setEnabled(len(self.undo_stack) > 0)
+        redo_action = getattr(self.main_window, 'redo_toolbar_action', None)
+        if redo_action is not None:
+            redo_action.setEnabled(len(self.redo_stack) > 0)
     
     def clear_history(self):
-        """清空历史"""
+        """清空历史 - 切换文档时调用，释放旧文档在历史和调整缓存中持有的图像"""
+        # 尚未计算的调整属于旧文档
+        self._adjust_timer.stop()
+        
+        # 命令只被撤销/重做栈引用，清空后其中的像素块立即释放
         self.undo_stack.clear()
         self.redo_stack.clear()
+        # 旧文件随最后引用它的像素块一起删除，新文档从空文件开始
+        self._history_spill = SpillFile()
+        self.undo_stack.spill_file = self._history_spill
+        self.redo_stack.spill_file = self._history_spill
+        self._pending_edit = None
+        self._adjust_command = None
+        self._last_stroke = None
         self._original_images.clear()
         self._adjustment_values.clear()
         self._current_adjustment_type = None
+        self._reset_selection_state()
         self._update_undo_redo_buttons()
     
     # ===================== 选区操作 =====================
@@ -1005,12 +1522,14 @@ class Controller(QObject):
         
         # 通用剪切逻辑
         if self.selection_content:
-            # 复制到剪贴板
+            # 复制到剪贴板 - selection_content 的像素由Qt自己分配，剪贴板共享引用即可
             clipboard = QApplication.clipboard()
             clipboard.setImage(self.selection_content)
             
-            # 从图层中删除选区内容
-            self.delete_selection()
+            # 从图层中删除选区内容(只记录一次历史，不再经过 delete_selection 的提示)
+            if self._erase_selection_area():
+                self._reset_selection_state()
+                self.temp_pixmap = None
             
             self.status_updated.emit("选区内容已剪切到剪贴板")
             return True
@@ -1021,7 +1540,7 @@ class Controller(QObject):
         """粘贴选区"""
         # 首先检查剪贴板
         clipboard = QApplication.clipboard()
-        image = clipboard.image()
+        image = clipboard.image()  # 剪贴板图像的格式取决于来源程序
         
         if image.isNull():
             # 如果没有图像，尝试工具粘贴
@@ -1033,11 +1552,8 @@ class Controller(QObject):
             self.status_updated.emit("剪贴板中没有图像内容")
             return False
         
-        # 如果有图像，创建新的图层来粘贴
-        self.save_to_history()
-        
-        # 创建新图层
-        new_layer = self.add_layer("粘贴", image=image)
+        # 如果有图像，创建新的图层来粘贴(add_layer 记录历史)
+        new_layer = self.add_layer("粘贴", image=self._normalize_image(image))
         if new_layer:
             self.status_updated.emit("已从剪贴板粘贴图像")
             return True
@@ -1056,23 +1572,7 @@ class Controller(QObject):
                 return tool.delete_selection()
         
         # 通用删除逻辑
-        if self.active_layer_index >= 0 and self.active_layer_index < len(self.layers):
-            self.save_to_history()
-            
-            active_layer = self.layers[self.active_layer_index]
-            image = active_layer['image']
-            
-            # 创建临时图像
-            temp_image = image.copy()
-            painter = QPainter(temp_image)
-            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
-            painter.fillRect(self.selection_rect, QColor(0, 0, 0, 0))
-            painter.end()
-            
-            active_layer['image'] = temp_image
-            self.schedule_update()
-            self.is_modified = True
-            
+        if self._erase_selection_area():
             # 清除选区
             self.clear_selection()
             
@@ -1081,6 +1581,35 @@ class Controller(QObject):
         
         return False
     
+    def _erase_selection_area(self):
+        """清除活动图层上选区内的像素并记录历史，不处理选区状态和提示"""
+        if not (0 <= self.active_layer_index < len(self.layers)):
+            return False
+        
+        # 进行中的绘制先单独记录，差分才只包含这次清除
+        self._commit_layer_edit()
+        
+        index = self.active_layer_index
+        image = self.layers[index]['image']
+        rect = self.selection_rect.intersected(image.rect())
+        
+        # 历史只保存选区内的差分，直接在图层上清除，不复制整层
+        before = self._snapshot_region(image, rect)
+        
+        # 预乘格式下全透明即全部通道为0，直接清零像素，不经过 QPainter
+        # (可写视图会先让图层图像与历史中共享的副本分离)
+        if not rect.isEmpty():
+            pixels = ImageProcessor.qimage_array(image, writable=True)
+            pixels[rect.y():rect.y() + rect.height(), rect.x():rect.x() + rect.width()] = 0
+        
+        patches = xor_patches(image, [before])
+        if patches:
+            self._push_command(LayerPatchCommand(index, patches))
+        
+        self.schedule_update(rect)
+        self.is_modified = True
+        return True
+    
     def select_all(self):
         """全选"""
         if not self.current_image:
@@ -1091,16 +1620,13 @@ class Controller(QObject):
         self.is_selection_active = True
         
         # 获取选区内容
-        self.selection_content = self.current_image.copy(self.selection_rect)
+        self.selection_content = self._normalize_image(self.current_image.copy(self.selection_rect))
         
         self.status_updated.emit(f"全选: {self.selection_rect.width()}x{self.selection_rect.height()}")
     
     def clear_selection(self):
         """清除选区"""
-        self.selection_rect = None
-        self.selection_content = None
-        self.is_selection_active = False
-        self.selection_transform = None
+        self._reset_selection_state()
         
         # 清除临时预览
         if hasattr(self, 'temp_pixmap'):
@@ -1110,6 +1636,13 @@ class Controller(QObject):
         
         self.status_updated.emit("选区已清除")
     
+    def _reset_selection_state(self):
+        """只清除选区数据，不刷新画布也不发送状态消息"""
+        self.selection_rect = None
+        self.selection_content = None
+        self.is_selection_active = False
+        self.selection_transform = None
+    
     def commit_selection(self):
         """提交选区"""
         if not self.is_selection_active or not self.selection_rect:
@@ -1224,23 +1757,23 @@ class Controller(QObject):
     
     def on_size_changed(self, value: int):
         """画笔大小改变事件"""
-        # 可以在这里添加额外处理
-        pass
+        self.brush_props_revision += 1
     
     def on_opacity_changed(self, value: int):
         """不透明度改变事件"""
-        # 可以在这里添加额外处理
-        pass
+        self.brush_props_revision += 1
     
     def on_fg_color_changed(self, color: QColor):
         """前景色改变事件"""
-        # 可以在这里添加额外处理
+        self.fg_version += 1
+        self.brush_props_revision += 1
         if hasattr(self.main_window, 'property_panel'):
             self.main_window.property_panel.fg_button.set_color(color)
     
     def on_bg_color_changed(self, color: QColor):
         """背景色改变事件"""
-        # 可以在这里添加额外处理
+        self.bg_version += 1
+        self.brush_props_revision += 1
         if hasattr(self.main_window, 'property_panel'):
             self.main_window.property_panel.bg_button.set_color(color)
     
@@ -1282,47 +1815,45 @@ class Controller(QObject):
         """添加文字到画布"""
         if not text or not self.layers or self.active_layer_index < 0:
             return
-
-        self.save_to_history()
-
+        
         def draw_text(painter):
             painter.setRenderHint(QPainter.RenderHint.Antialiasing)
             painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
-
+            
             # 保存当前状态
             painter.save()
-
+            
             # 如果指定了位置，移动到该位置
             if position:
                 painter.translate(position.x(), position.y())
-
+            
             # 应用旋转
             if rotation != 0:
                 painter.rotate(rotation)
-
+            
             # 应用缩放
             if scale != 1.0:
                 painter.scale(scale, scale)
-
+            
             # 设置字体和颜色
             painter.setFont(font)
-
+            
             # 处理透明色
             if hasattr(color, 'alpha') and color.alpha() == 0:
                 # 对于透明色，绘制文字轮廓
                 painter.setPen(QPen(QColor(0, 0, 0, 100), 1))
             else:
                 painter.setPen(color)
-
+            
             # 绘制文字
             painter.drawText(0, 0, text)
-
+            
             # 恢复状态
             painter.restore()
-
+        
         save_history = True
         self.draw_on_active_layer(draw_text, save_history)
-
+        
         self.status_updated.emit(f"已添加文字: {text[:20]}...")
     
     # ===================== 其他功能 =====================
@@ -1357,23 +1888,11 @@ class Controller(QObject):
     
     def check_save_before_close(self):
         """关闭前检查保存"""
-        if not self.is_modified:
-            return True
-        
-        reply = QMessageBox.question(
-            self.main_window, '保存更改',
-            "当前图像已修改,是否保存?",
-            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No | 
-            QMessageBox.StandardButton.Cancel
-        )
-        
-        if reply == QMessageBox.StandardButton.Yes:
-            self.save_file()
-            return True
-        elif reply == QMessageBox.StandardButton.Cancel:
+        if not self._confirm_and_save_if_dirty():
             return False
         
-        return True
+        # 文档关闭前必须写完；后台保存失败时保留窗口
+        return self.wait_for_pending_saves()
     
     # ===================== 透明色处理 =====================
     
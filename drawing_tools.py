@@ -1,142 +1,261 @@
 # drawing_tools.py - 绘图工具类
-from PyQt6.QtCore import Qt, QPointF, QTimer
-from PyQt6.QtGui import QColor, QPen, QPainter, QBrush, QImage, QPixmap, QCursor
+from PyQt6.QtCore import Qt, QPointF, QRect, QTimer
+from PyQt6.QtGui import QColor, QPen, QPainter, QImage, QPixmap, QCursor, QPolygonF
+from functools import partial
 import math
-from base_tool import BaseTool
+import numpy as np
+from base_tool import BaseTool, BUTTON_RIGHT
+from image_processor import ImageProcessor
 
 
-class BrushTool(BaseTool):
-    """画笔工具"""
+def _bgra(color, premultiplied):
+    """QColor 转换为缓冲区字节顺序(B, G, R, A)的 int16 数组"""
+    a = color.alpha()
+    b, g, r = color.blue(), color.green(), color.red()
+    if premultiplied:
+        b, g, r = ((c * a + 127) // 255 for c in (b, g, r))
+    return np.array([b, g, r, a], dtype=np.int16)
+
+
+def _within_tolerance(colors, target, tolerance):
+    """颜色与目标的欧氏距离(4个通道)是否不超过 tolerance - 橡皮擦和填充共用的判断
+    
+    按通道(SoA)逐个累加差值平方，每步都是连续的 int32 向量运算；
+    大部分像素在前几个通道就已超出容差时，改为只对剩余候选像素计算后面的通道
+    """
+    shape = colors.shape[:-1]
+    flat = colors.reshape(-1, colors.shape[-1])
+    limit = tolerance * tolerance
+    total = _squared_diff(flat[:, 0], target[0])
+    candidates = None  # 已收缩时为仍在容差内的像素下标
+    for c in range(1, 4):
+        if candidates is None:
+            close = total <= limit
+            if np.count_nonzero(close) * 4 >= close.size:
+                total += _squared_diff(flat[:, c], target[c])
+                continue
+            candidates = np.flatnonzero(close)
+            total = total[candidates]
+        if candidates.size == 0:
+            break
+        total += _squared_diff(flat[candidates, c], target[c])
+        keep = total <= limit
+        candidates, total = candidates[keep], total[keep]
+    
+    if candidates is None:
+        return (total <= limit).reshape(shape)
+    result = np.zeros(flat.shape[0], dtype=bool)
+    result[candidates] = True
+    return result.reshape(shape)
+
+
+def _squared_diff(channel, value):
+    """单个通道与目标值之差的平方(int32)"""
+    d = channel.astype(np.int32)
+    d -= int(value)
+    d *= d
+    return d
+
+
+def _source_over(pixels, mask, color, premultiplied):
+    """把颜色按 SourceOver 混合到 pixels(BGRA视图)中 mask 选中的像素上"""
+    source = _bgra(color, True)
+    alpha = int(source[3])
+    if alpha == 255:
+        pixels[mask] = source
+        return
+    
+    # 半透明颜色: 结果 = 源 + 目标 * (1 - 源alpha)，在预乘空间计算
+    dest = pixels[mask].astype(np.uint16)
+    if not premultiplied:
+        dest[:, :3] = (dest[:, :3] * dest[:, 3:] + 127) // 255
+    blended = source + (dest * (255 - alpha) + 127) // 255
+    if not premultiplied:
+        a = blended[:, 3:]
+        blended[:, :3] = np.where(a > 0, (blended[:, :3] * 255 + a // 2) // np.maximum(a, 1), 0)
+    pixels[mask] = blended.astype(np.uint8)
+
+
+class StrokeTool(BaseTool):
+    """连续笔画工具的基类 - 移动事件只记录路径点，按屏幕刷新间隔一次绘制累积的折线
+    
+    高回报率的数位板每秒产生数百个移动事件，逐个绘制的开销远超屏幕能显示的内容；
+    合并后每帧只调用一次 draw_on_active_layer，折线也不会丢失中间的拐点
+    """
+    FLUSH_INTERVAL_MS = 16
+    
     def __init__(self, controller):
         super().__init__(controller)
         self.last_point = None
+        # 追加路径点开销很小，所有移动事件都直接处理，不再节流丢点
+        self._move_interval_ms = 0
+        self._flush_timer = QTimer()
+        self._flush_timer.setInterval(self.FLUSH_INTERVAL_MS)
+        self._flush_timer.timeout.connect(self._flush_stroke)
+        self._pen = None  # 缓存的画笔，属性变化时置为 None 重新创建
+    
+    def _do_move(self, event, image_pos):
+        """鼠标移动事件"""
+        super()._do_move(event, image_pos)
+        
+        if self.drawing and self.last_point:
+            self.append_point(image_pos.x(), image_pos.y())
+            if not self._flush_timer.isActive():
+                self._flush_timer.start()
+    
+    def mouse_release(self, event, image_pos):
+        """鼠标释放事件 - 先绘制尚未绘制的路径"""
+        super().mouse_release(event, image_pos)
+        
+        if event.button() in (Qt.MouseButton.LeftButton, Qt.MouseButton.RightButton):
+            self._flush_stroke()
+            self.drawing = False
+            self.draw_batch_started = False
+            self.last_point = None
+    
+    def cancel(self):
+        """取消当前操作"""
+        self._flush_timer.stop()
+        self.clear_points()
+        super().cancel()
+    
+    def _flush_stroke(self):
+        """绘制自上次绘制以来累积的路径点"""
+        if not self._n_points:
+            # 没有新的移动，等下次移动再启动
+            self._flush_timer.stop()
+            return
+        
+        points = [self.last_point]
+        points.extend(QPointF(float(x), float(y)) for x, y in self.points_view())
+        self.clear_points()
+        self.last_point = points[-1]
+        self._draw_polyline(points)
+    
+    def _draw_polyline(self, points):
+        """绘制经过 points(QPointF列表，至少两个点)的折线 - 子类实现"""
+        raise NotImplementedError
+    
+    def _stroke_pen(self, color, width):
+        """返回圆头圆角画笔 - 每次绘制复用同一个对象，直到子类把 _pen 置为 None"""
+        pen = self._pen
+        if pen is None:
+            pen = self._pen = QPen(color, width)
+            pen.setCapStyle(Qt.PenCapStyle.RoundCap)
+            pen.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
+        return pen
+    
+    @classmethod
+    def _polyline_rects(cls, points, size):
+        """折线各段的包围矩形 - 斜向的长折线只涉及沿线的块，而不是整个包围盒"""
+        return [cls._stroke_rect(a, b, size) for a, b in zip(points, points[1:])]
+
+
+class BrushTool(StrokeTool):
+    """画笔工具"""
+    def __init__(self, controller):
+        super().__init__(controller)
         self.brush_size = 10
         self.brush_opacity = 100
         self.brush_color = QColor("black")
         self.brush_hardness = 0.5
+        # 按下时根据颜色确定的绘制模式，整笔不变
+        self._comp_mode = QPainter.CompositionMode.CompositionMode_SourceOver
+        self._pen_color = self.brush_color
+        self._opacity_f = 1.0
     
     def mouse_press(self, event, image_pos):
         """鼠标按下事件"""
         super().mouse_press(event, image_pos)
-
+        
         if event.button() in (Qt.MouseButton.LeftButton, Qt.MouseButton.RightButton):
             self.drawing = True
             self.start_pos = image_pos
             self.last_point = image_pos
             self.draw_batch_started = True
-
+            
             # 获取当前画笔属性
             self._update_brush_properties()
-
+            
             # 开始绘制
             self._draw_point(image_pos)
     
-    def mouse_move(self, event, image_pos):
-        """鼠标移动事件"""
-        super().mouse_move(event, image_pos)
-        
-        if self.drawing and self.last_point:
-            self._draw_line(self.last_point, image_pos)
-            self.last_point = image_pos
-    
-    def mouse_release(self, event, image_pos):
-        """鼠标释放事件"""
-        super().mouse_release(event, image_pos)
-        
-        if event.button() in (Qt.MouseButton.LeftButton, Qt.MouseButton.RightButton):
-            self.drawing = False
-            self.draw_batch_started = False
-            self.last_point = None
-    
     def _update_brush_properties(self):
-        """更新画笔属性"""
-        if self.controller:
-            self.brush_size = self.controller.get_current_size()
+        """更新画笔属性 - 属性面板未改变时沿用上次的结果"""
+        if self.controller and self._props_changed():
+            size = self.controller.get_current_size()
             self.brush_opacity = self.controller.get_current_opacity()
             
             # 获取绘制颜色
-            color = self._get_drawing_color()
-            if color:
-                self.brush_color = color
+            color = self._get_drawing_color() or self.brush_color
+            if size != self.brush_size or color != self.brush_color:
+                self._pen = None
+            self.brush_size = size
+            self.brush_color = color
+            
+            # 透明色按清除处理 - 在笔画开始时判断一次，绘制回调直接使用结果
+            if color.alpha() == 0:
+                self._comp_mode = QPainter.CompositionMode.CompositionMode_Clear
+                self._pen_color = QColor(0, 0, 0, 0)
+                self._opacity_f = 1.0
+            else:
+                self._comp_mode = QPainter.CompositionMode.CompositionMode_SourceOver
+                self._pen_color = color
+                self._opacity_f = self.brush_opacity / 100.0
+    
+    def _setup_painter(self, painter):
+        """设置合成模式、不透明度和(缓存的)画笔 - 抗锯齿已由 draw_on_active_layer 开启"""
+        painter.setCompositionMode(self._comp_mode)
+        painter.setPen(self._stroke_pen(self._pen_color, self.brush_size))
+        painter.setOpacity(self._opacity_f)
     
     def _draw_point(self, point):
         """绘制单个点"""
         if not self.controller:
             return
-
+        
         def draw_func(painter):
-            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-
-            # 检查是否透明色
-            if self.brush_color.alpha() == 0:
-                painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
-                pen = QPen(QColor(0, 0, 0, 0), self.brush_size)
-                painter.setOpacity(1.0)
-            else:
-                painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
-                pen = QPen(self.brush_color, self.brush_size)
-                painter.setOpacity(self.brush_opacity / 100.0)
-
-            pen.setCapStyle(Qt.PenCapStyle.RoundCap)
-            pen.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
-            painter.setPen(pen)
-
             # 绘制点
             painter.drawPoint(int(point.x()), int(point.y()))
-
+        
         # 在活动图层绘制
         self.controller.draw_on_active_layer(
             draw_func,
+            state_setup=self._setup_painter,
             save_history=self.draw_batch_started,
             is_batch_start=self.draw_batch_started,
-            is_batch_end=not self.drawing
+            is_batch_end=not self.drawing,
+            dirty_rect=self._stroke_rect(point, point, self.brush_size)
         )
         self.draw_batch_started = False
     
-    def _draw_line(self, start_point, end_point):
-        """绘制线条"""
+    def _draw_polyline(self, points):
+        """绘制折线"""
         if not self.controller:
             return
-
+        
         def draw_func(painter):
-            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-
-            # 检查是否透明色
-            if self.brush_color.alpha() == 0:
-                painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
-                pen = QPen(QColor(0, 0, 0, 0), self.brush_size)
-                painter.setOpacity(1.0)
-            else:
-                painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
-                pen = QPen(self.brush_color, self.brush_size)
-                painter.setOpacity(self.brush_opacity / 100.0)
-
-            pen.setCapStyle(Qt.PenCapStyle.RoundCap)
-            pen.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
-            painter.setPen(pen)
-
-            # 绘制线条
-            painter.drawLine(
-                int(start_point.x()), int(start_point.y()),
-                int(end_point.x()), int(end_point.y())
-            )
-
+            # 一次绘制整条折线，连接处按 RoundJoin 处理
+            painter.drawPolyline(QPolygonF(points))
+        
         # 在活动图层绘制
         self.controller.draw_on_active_layer(
             draw_func,
+            state_setup=self._setup_painter,
             save_history=False,
             is_batch_start=False,
-            is_batch_end=not self.drawing
+            is_batch_end=not self.drawing,
+            dirty_rect=self._polyline_rects(points, self.brush_size)
         )
 
 
-class EraserTool(BaseTool):
+class EraserTool(StrokeTool):
     """橡皮擦工具"""
     def __init__(self, controller):
         super().__init__(controller)
-        self.last_point = None
         self.eraser_size = 20
         self.eraser_opacity = 100
+        self._opacity_f = 1.0
     
     def mouse_press(self, event, image_pos):
         """鼠标按下事件"""
@@ -154,173 +273,172 @@ class EraserTool(BaseTool):
             # 开始擦除
             self._erase_point(image_pos)
     
-    def mouse_move(self, event, image_pos):
-        """鼠标移动事件"""
-        super().mouse_move(event, image_pos)
-        
-        if self.drawing and self.last_point:
-            self._erase_line(self.last_point, image_pos)
-            self.last_point = image_pos
-    
-    def mouse_release(self, event, image_pos):
-        """鼠标释放事件"""
-        super().mouse_release(event, image_pos)
-        
-        if event.button() in (Qt.MouseButton.LeftButton, Qt.MouseButton.RightButton):
-            self.drawing = False
-            self.draw_batch_started = False
-            self.last_point = None
-    
     def _update_eraser_properties(self):
-        """更新橡皮擦属性"""
-        if self.controller:
-            self.eraser_size = self.controller.get_current_size()
+        """更新橡皮擦属性 - 属性面板未改变时沿用上次的结果"""
+        if self.controller and self._props_changed():
+            size = self.controller.get_current_size()
+            if size != self.eraser_size:
+                self._pen = None
+            self.eraser_size = size
             self.eraser_opacity = self.controller.get_current_opacity()
+            self._opacity_f = self.eraser_opacity / 100.0
     
     def _erase_point(self, point):
         """擦除单个点"""
         if not self.controller:
             return
         
-        def erase_func(painter):
-            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        # 如果是右键，执行颜色替换擦除 - 直接改写像素，不经过 painter
+        if self._is_replacing():
+            target_color = self.controller.get_current_fg_color()
+            replace_color = self.controller.get_current_bg_color()
             
-            # 如果是右键，执行颜色替换擦除
-            if self.tool_state['mouse_button'] == 'right' or self.tool_state['is_right_button_during_drag']:
-                target_color = self.controller.get_current_fg_color()
-                replace_color = self.controller.get_current_bg_color()
-                self._replace_color_at_point(painter, point.x(), point.y(), self.eraser_size, target_color, replace_color)
-            else:
-                # 左键：透明擦除
-                # 使用清除模式
-                painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
-                
-                # 设置橡皮擦画笔
-                pen = QPen(QColor(0, 0, 0, 0), self.eraser_size)
-                pen.setCapStyle(Qt.PenCapStyle.RoundCap)
-                pen.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
-                painter.setPen(pen)
-                
-                # 擦除点
-                painter.setOpacity(self.eraser_opacity / 100.0)
+            def erase_func(image):
+                self._replace_color_at_point(image, point.x(), point.y(), self.eraser_size, target_color, replace_color)
+            edit = self.controller.modify_active_layer
+        else:
+            def erase_func(painter):
+                # 左键：透明擦除 - 清除模式和画笔由 _setup_painter 设置
                 painter.drawPoint(int(point.x()), int(point.y()))
+            edit = partial(self.controller.draw_on_active_layer, state_setup=self._setup_painter)
         
         # 在活动图层擦除
-        self.controller.draw_on_active_layer(
+        edit(
             erase_func,
             save_history=self.draw_batch_started,
             is_batch_start=self.draw_batch_started,
-            is_batch_end=not self.drawing
+            is_batch_end=not self.drawing,
+            dirty_rect=self._stroke_rect(point, point, self.eraser_size)
         )
         self.draw_batch_started = False
     
-    def _erase_line(self, start_point, end_point):
-        """擦除线条"""
+    def _draw_polyline(self, points):
+        """沿折线擦除"""
         if not self.controller:
             return
         
-        def erase_func(painter):
-            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        # 如果是右键，执行颜色替换擦除 - 直接改写像素，不经过 painter
+        if self._is_replacing():
+            target_color = self.controller.get_current_fg_color()
+            replace_color = self.controller.get_current_bg_color()
             
-            # 如果是右键，执行颜色替换擦除
-            if self.tool_state['mouse_button'] == 'right' or self.tool_state['is_right_button_during_drag']:
-                target_color = self.controller.get_current_fg_color()
-                replace_color = self.controller.get_current_bg_color()
-                self._replace_color_along_line(painter, start_point, end_point, self.eraser_size, target_color, replace_color)
-            else:
-                # 左键：透明擦除
-                # 使用清除模式
-                painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
-                
-                # 设置橡皮擦画笔
-                pen = QPen(QColor(0, 0, 0, 0), self.eraser_size)
-                pen.setCapStyle(Qt.PenCapStyle.RoundCap)
-                pen.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
-                painter.setPen(pen)
-                
-                # 擦除线条
-                painter.setOpacity(self.eraser_opacity / 100.0)
-                painter.drawLine(
-                    int(start_point.x()), int(start_point.y()),
-                    int(end_point.x()), int(end_point.y())
-                )
+            def erase_func(image):
+                for start_point, end_point in zip(points, points[1:]):
+                    self._replace_color_along_line(image, start_point, end_point, self.eraser_size,
+                                                   target_color, replace_color)
+            edit = self.controller.modify_active_layer
+        else:
+            def erase_func(painter):
+                # 左键：透明擦除 - 清除模式和画笔由 _setup_painter 设置
+                painter.drawPolyline(QPolygonF(points))
+            edit = partial(self.controller.draw_on_active_layer, state_setup=self._setup_painter)
         
         # 在活动图层擦除
-        self.controller.draw_on_active_layer(
+        edit(
             erase_func,
             save_history=False,
             is_batch_start=False,
-            is_batch_end=not self.drawing
+            is_batch_end=not self.drawing,
+            dirty_rect=self._polyline_rects(points, self.eraser_size)
         )
-
-    def _replace_color_at_point(self, painter, x, y, size, target_color, replace_color):
+    
+    def _setup_painter(self, painter):
+        """设置清除模式、不透明度和(缓存的)橡皮擦画笔"""
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
+        painter.setPen(self._stroke_pen(QColor(0, 0, 0, 0), self.eraser_size))
+        painter.setOpacity(self._opacity_f)
+    
+    def _is_replacing(self):
+        """右键拖动执行颜色替换擦除"""
+        return self.mouse_button == BUTTON_RIGHT or self.is_right_button_during_drag
+    
+    def _replace_color_at_point(self, image, x, y, size, target_color, replace_color):
         """在单点替换颜色"""
         radius = size // 2
-        draw_device = painter.device()
-        if not isinstance(draw_device, QImage):
+        region = self._clip_box(image, x - radius, y - radius, x + radius, y + radius)
+        if region is None:
             return
         
-        image = draw_device
-        for px in range(max(0, int(x - radius)), min(image.width(), int(x + radius) + 1)):
-            for py in range(max(0, int(y - radius)), min(image.height(), int(y + radius) + 1)):
-                distance = math.sqrt((px - x)**2 + (py - y)**2)
-                if distance <= radius:
-                    color = QColor(image.pixel(px, py))
-                    if self._is_color_close(color, target_color):
-                        painter.setPen(QPen(replace_color, 1))
-                        painter.drawPoint(px, py)
-
-    def _replace_color_along_line(self, painter, start_point, end_point, size, target_color, replace_color):
-        """沿直线替换颜色"""
-        dx = end_point.x() - start_point.x()
-        dy = end_point.y() - start_point.y()
-        length = math.sqrt(dx*dx + dy*dy)
-        if length == 0:
+        x0, y0, x1, y1 = region
+        yy, xx = np.ogrid[y0:y1, x0:x1]
+        inside = (xx - x) ** 2 + (yy - y) ** 2 <= radius * radius
+        self._replace_color_in_mask(image, x0, y0, inside, target_color, replace_color)
+    
+    @staticmethod
+    def _clip_box(image, left, top, right, bottom):
+        """把浮点包围盒转换为图像内的像素范围(x0, y0, x1, y1)，为空时返回 None"""
+        x0, y0 = max(0, int(left)), max(0, int(top))
+        x1, y1 = min(image.width(), int(right) + 1), min(image.height(), int(bottom) + 1)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return x0, y0, x1, y1
+    
+    def _replace_color_in_mask(self, image, x0, y0, shape_mask, target_color, replace_color, tolerance=50):
+        """把 shape_mask 覆盖范围内与目标颜色相近的像素替换为 replace_color
+        
+        直接读写图像缓冲区(BGRA)：与目标颜色的欧氏距离不超过 tolerance 即视为相近；
+        替换色按 SourceOver 混合，与原先逐点 drawPoint 的结果一致
+        """
+        h, w = shape_mask.shape
+        pixels = ImageProcessor.qimage_array(image, writable=True)[y0:y0 + h, x0:x0 + w]
+        
+        premultiplied = image.format() == QImage.Format.Format_ARGB32_Premultiplied
+        target = _bgra(target_color, premultiplied)
+        # 只比较形状内的像素: 斜线段的包围盒中大部分像素在胶囊形之外
+        close = _within_tolerance(pixels[shape_mask], target, tolerance)
+        if not close.any():
             return
+        mask = shape_mask.copy()
+        mask[shape_mask] = close
         
-        steps = max(2, int(length))
-        radius = size // 2
-        draw_device = painter.device()
+        _source_over(pixels, mask, replace_color, premultiplied)
+    
+    def _replace_color_along_line(self, image, start_point, end_point, size, target_color, replace_color):
+        """沿直线替换颜色 - 一次计算整条线段(含半径的胶囊形)覆盖的像素"""
+        sx, sy = start_point.x(), start_point.y()
+        vx, vy = end_point.x() - sx, end_point.y() - sy
+        length_sq = vx * vx + vy * vy
+        if length_sq == 0:
+            return
         
-        if not isinstance(draw_device, QImage):
+        radius = size // 2
+        region = self._clip_box(image, min(sx, sx + vx) - radius, min(sy, sy + vy) - radius,
+                                max(sx, sx + vx) + radius, max(sy, sy + vy) + radius)
+        if region is None:
             return
         
-        image = draw_device
-        for i in range(steps + 1):
-            t = i / steps
-            x = start_point.x() + dx * t
-            y = start_point.y() + dy * t
-            
-            for px in range(max(0, int(x - radius)), min(image.width(), int(x + radius) + 1)):
-                for py in range(max(0, int(y - radius)), min(image.height(), int(y + radius) + 1)):
-                    distance = math.sqrt((px - x)**2 + (py - y)**2)
-                    if distance <= radius:
-                        color = QColor(image.pixel(px, py))
-                        if self._is_color_close(color, target_color):
-                            painter.setPen(QPen(replace_color, 1))
-                            painter.drawPoint(px, py)
-
-    def _is_color_close(self, color1, color2, tolerance=50):
-        """判断颜色是否相近"""
-        r_diff = abs(color1.red() - color2.red())
-        g_diff = abs(color1.green() - color2.green())
-        b_diff = abs(color1.blue() - color2.blue())
-        a_diff = abs(color1.alpha() - color2.alpha())
-        total_diff = r_diff + g_diff + b_diff + a_diff
-        return total_diff <= tolerance
+        # 像素到线段的距离: 投影参数 t 限制在 [0, 1]
+        x0, y0, x1, y1 = region
+        yy, xx = np.ogrid[y0:y1, x0:x1]
+        wx, wy = xx - sx, yy - sy
+        t = np.clip((wx * vx + wy * vy) / length_sq, 0.0, 1.0)
+        dx, dy = wx - t * vx, wy - t * vy
+        inside = dx * dx + dy * dy <= radius * radius
+        self._replace_color_in_mask(image, x0, y0, inside, target_color, replace_color)
 
 
 class AirbrushTool(BaseTool):
     """喷枪工具"""
+    RENDER_DELAY_MS = 16  # 移动事件合并到下一帧绘制
+    DWELL_MS = 80  # 鼠标停住时的喷涂间隔
+    
     def __init__(self, controller):
         super().__init__(controller)
         self.last_point = None
         self.spray_size = 20
         self.spray_opacity = 50
         self.spray_density = 50
+        # 移动时按帧合并绘制；鼠标停住超过 DWELL_MS 后由停留定时器继续喷涂
+        self._render_scheduled = False
         self.spray_timer = QTimer()
-        self.spray_timer.timeout.connect(self._spray_paint)
+        self.spray_timer.setInterval(self.DWELL_MS)
+        self.spray_timer.timeout.connect(self._dwell_spray)
         self.spray_positions = []
+        self._rng = np.random.default_rng()
+        # 按下时根据颜色确定的绘制状态，整次喷涂不变
+        self._comp_mode = QPainter.CompositionMode.CompositionMode_SourceOver
+        self._pen = QPen(QColor("black"), 1)
+        self._opacity_f = 0.5
     
     def mouse_press(self, event, image_pos):
         """鼠标按下事件"""
@@ -337,15 +455,19 @@ class AirbrushTool(BaseTool):
             
             # 开始喷涂
             self.spray_positions = [image_pos]
-            self.spray_timer.start(50)  # 每50ms喷涂一次
+            self._schedule_spray()
+            self.spray_timer.start()
     
-    def mouse_move(self, event, image_pos):
+    def _do_move(self, event, image_pos):
         """鼠标移动事件"""
-        super().mouse_move(event, image_pos)
+        super()._do_move(event, image_pos)
         
         if self.drawing:
             self.last_point = image_pos
             self.spray_positions.append(image_pos)
+            self._schedule_spray()
+            # 移动中不需要停留喷涂，重新开始计时
+            self.spray_timer.start()
     
     def mouse_release(self, event, image_pos):
         """鼠标释放事件"""
@@ -359,8 +481,8 @@ class AirbrushTool(BaseTool):
             self.spray_positions.clear()
     
     def _update_spray_properties(self):
-        """更新喷枪属性"""
-        if self.controller:
+        """更新喷枪属性 - 属性面板未改变时沿用上次的结果"""
+        if self.controller and self._props_changed():
             self.spray_size = self.controller.get_current_size()
             self.spray_opacity = self.controller.get_current_opacity()
             
@@ -370,55 +492,76 @@ class AirbrushTool(BaseTool):
                 self.spray_color = color
             else:
                 self.spray_color = QColor("black")
+            
+            # 透明色按清除处理 - 按下时确定一次，_setup_painter 直接使用
+            if self.spray_color.alpha() == 0:
+                self._comp_mode = QPainter.CompositionMode.CompositionMode_Clear
+                self._pen = QPen(QColor(0, 0, 0, 0), 1)
+                self._opacity_f = 1.0
+            else:
+                self._comp_mode = QPainter.CompositionMode.CompositionMode_SourceOver
+                self._pen = QPen(self.spray_color, 1)
+                self._opacity_f = self.spray_opacity / 100.0
+    
+    def _setup_painter(self, painter):
+        """设置按下时确定的合成模式、画笔和不透明度"""
+        painter.setCompositionMode(self._comp_mode)
+        painter.setPen(self._pen)
+        painter.setOpacity(self._opacity_f)
+    
+    def _schedule_spray(self):
+        """在下一帧绘制累积的喷涂位置，同一帧内的多次移动只绘制一次"""
+        if not self._render_scheduled:
+            self._render_scheduled = True
+            QTimer.singleShot(self.RENDER_DELAY_MS, self._spray_paint)
+    
+    def _dwell_spray(self):
+        """鼠标停住时在当前位置继续喷涂"""
+        if self.drawing and self.last_point is not None:
+            self.spray_positions.append(self.last_point)
+            self._schedule_spray()
     
     def _spray_paint(self):
         """喷涂效果"""
+        self._render_scheduled = False
         if not self.drawing or not self.spray_positions or not self.controller:
             return
-
+        
+        points = self._spray_points()
+        
         def spray_func(painter):
-            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-
-            # 检查是否透明色
-            if self.spray_color.alpha() == 0:
-                painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
-                painter.setPen(QPen(QColor(0, 0, 0, 0), 1))
-                painter.setOpacity(1.0)
-            else:
-                painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
-                painter.setPen(QPen(self.spray_color, 1))
-                painter.setOpacity(self.spray_opacity / 100.0)
-
-            # 在多个位置喷涂
-            for pos in self.spray_positions:
-                x = int(pos.x())
-                y = int(pos.y())
-                radius = self.spray_size // 2
-
-                # 生成随机点进行喷涂
-                import random
-                density = max(1, self.spray_density // 10)
-
-                for _ in range(density):
-                    angle = random.uniform(0, 2 * math.pi)
-                    distance = random.uniform(0, radius)
-                    spray_x = x + distance * math.cos(angle)
-                    spray_y = y + distance * math.sin(angle)
-
-                    # 绘制小点
-                    painter.drawPoint(int(spray_x), int(spray_y))
-
-        # 在活动图层喷涂
+            # 所有位置的随机点一次生成，一次绘制
+            painter.drawPoints(QPolygonF([QPointF(x, y) for x, y in points.tolist()]))
+        
+        # 在活动图层喷涂 - 历史只保存各喷涂位置覆盖的块
         self.controller.draw_on_active_layer(
             spray_func,
             save_history=self.draw_batch_started,
             is_batch_start=self.draw_batch_started,
-            is_batch_end=False
+            is_batch_end=False,
+            dirty_rect=[self._stroke_rect(pos, pos, self.spray_size) for pos in self.spray_positions],
+            state_setup=self._setup_painter
         )
         self.draw_batch_started = False
-
+        
         # 清空位置队列
         self.spray_positions.clear()
+    
+    def _spray_points(self):
+        """为每个待喷涂位置生成圆内均匀分布的随机点，返回(N, 2)整数坐标数组
+        
+        半径取 sqrt(均匀分布)，点在圆面积上均匀，而不是集中在圆心附近
+        """
+        centers = np.array([(int(p.x()), int(p.y())) for p in self.spray_positions], dtype=np.float64)
+        density = max(1, self.spray_density // 10)
+        radius = self.spray_size // 2
+        
+        shape = (len(centers), density)
+        angles = self._rng.uniform(0.0, 2 * math.pi, shape)
+        distances = radius * np.sqrt(self._rng.random(shape))
+        xs = centers[:, 0:1] + distances * np.cos(angles)
+        ys = centers[:, 1:2] + distances * np.sin(angles)
+        return np.stack((xs, ys), axis=-1).reshape(-1, 2).astype(np.int32)
 
 
 class FillTool(BaseTool):
@@ -428,6 +571,7 @@ class FillTool(BaseTool):
         self.fill_color = QColor("black")
         self.fill_opacity = 100
         self.tolerance = 10
+        self._fill_pending = False  # 上一次填充的区域仍在后台计算
     
     def mouse_press(self, event, image_pos):
         """鼠标按下事件"""
@@ -441,8 +585,8 @@ class FillTool(BaseTool):
             self._perform_fill(int(image_pos.x()), int(image_pos.y()))
     
     def _update_fill_properties(self):
-        """更新填充属性"""
-        if self.controller:
+        """更新填充属性 - 属性面板未改变时沿用上次的结果"""
+        if self.controller and self._props_changed():
             self.fill_opacity = self.controller.get_current_opacity()
             
             # 获取绘制颜色
@@ -451,85 +595,106 @@ class FillTool(BaseTool):
                 self.fill_color = color
     
     def _perform_fill(self, x, y):
-        """执行填充操作"""
-        if not self.controller:
+        """执行填充操作 - 区域在线程池中计算，完成后在GUI线程写入图层"""
+        if not self.controller or self._fill_pending:
             return
         
         # 获取活动图层
-        if self.controller.active_layer_index < 0:
+        index = self.controller.active_layer_index
+        if index < 0:
+            return
+        
+        layer_image = self.controller.layers[index]['image']
+        if not layer_image.valid(x, y):
             return
         
-        active_layer = self.controller.layers[self.controller.active_layer_index]
-        layer_image = active_layer['image']
+        # 后台只读取隐式共享的副本；计算期间图层被修改时会先分离，不影响后台读取
+        source = [QImage(layer_image)]
+        premultiplied = layer_image.format() == QImage.Format.Format_ARGB32_Premultiplied
+        key = layer_image.cacheKey()
+        self._fill_pending = True
+        self.controller.run_in_background(
+            self._fill_region_job, (source, x, y, premultiplied),
+            lambda result, error: self._on_fill_region(result, error, index, key))
+    
+    def _fill_region_job(self, source, x, y, premultiplied):
+        """在线程池中计算填充区域和包围矩形 - 只处理numpy数据"""
+        try:
+            pixels = ImageProcessor.qimage_array(source[0])
+            similar = self._similar_mask(pixels, x, y, premultiplied)
+            region = ImageProcessor.flood_region(similar, x, y)
+        finally:
+            # 尽早释放共享引用，GUI线程写入图层时无需先分离复制整层
+            source.clear()
         
-        # 获取点击位置的颜色
-        target_color = layer_image.pixelColor(x, y)
-        if not target_color.isValid():
+        rows = np.flatnonzero(region.any(axis=1))
+        cols = np.flatnonzero(region.any(axis=0))
+        x0, x1 = int(cols[0]), int(cols[-1]) + 1
+        y0, y1 = int(rows[0]), int(rows[-1]) + 1
+        return region[y0:y1, x0:x1], QRect(x0, y0, x1 - x0, y1 - y0)
+    
+    def _on_fill_region(self, result, error, index, key):
+        """填充区域计算完成(在GUI线程执行)"""
+        self._fill_pending = False
+        controller = self.controller
+        if error or result is None:
+            controller.status_updated.emit(f"填充失败: {error}")
             return
         
-        # 保存历史
-        self.controller.save_to_history()
+        # 计算期间图层被修改或切换，区域已不对应当前内容
+        if (index != controller.active_layer_index or index >= len(controller.layers)
+                or controller.layers[index]['image'].cacheKey() != key):
+            controller.status_updated.emit("图层已改变，填充已取消")
+            return
         
-        def fill_func(painter):
-            # 实现洪水填充算法
-            self._flood_fill(painter, x, y, target_color, layer_image)
+        region, rect = result
         
-        # 在活动图层填充
-        self.controller.draw_on_active_layer(fill_func)
+        def fill_func(image):
+            self._apply_fill(image, region, rect.x(), rect.y())
         
-        if self.controller and hasattr(self.controller, 'status_updated'):
-            self.controller.status_updated.emit(f"区域填充完成")
+        # 在活动图层填充 - 直接改写像素缓冲区，不创建 painter；历史和重绘只涉及区域的包围矩形
+        controller.modify_active_layer(fill_func, dirty_rect=rect)
+        controller.status_updated.emit("区域填充完成")
     
-    def _flood_fill(self, painter, start_x, start_y, target_color, image):
-        """洪水填充算法（简化版）"""
-        # 获取图像尺寸
-        width = image.width()
-        height = image.height()
-
-        # 创建访问标记
-        visited = [[False] * height for _ in range(width)]
-
-        # 队列用于BFS
-        queue = [(start_x, start_y)]
-        visited[start_x][start_y] = True
-
-        # 检查是否透明色
+    def _apply_fill(self, image, region, x0, y0):
+        """用填充色改写 region(从 (x0, y0) 开始的布尔数组)选中的像素"""
+        h, w = region.shape
+        pixels = ImageProcessor.qimage_array(image, writable=True)[y0:y0 + h, x0:x0 + w]
         if self.fill_color.alpha() == 0:
-            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
-            painter.setBrush(QBrush(QColor(0, 0, 0, 0)))
-            painter.setPen(Qt.PenStyle.NoPen)
-            painter.setOpacity(1.0)
+            # 透明色清除区域
+            pixels[region] = 0
         else:
-            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
-            painter.setBrush(QBrush(self.fill_color))
-            painter.setPen(Qt.PenStyle.NoPen)
-            painter.setOpacity(self.fill_opacity / 100.0)
-
-        # BFS遍历相邻像素
-        while queue:
-            x, y = queue.pop(0)
-
-            # 检查当前像素是否匹配目标颜色（考虑容差）
-            pixel_color = image.pixelColor(x, y)
-            if self._colors_similar(pixel_color, target_color, self.tolerance):
-                # 填充当前像素
-                painter.drawRect(x, y, 1, 1)
-
-                # 添加相邻像素到队列
-                for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-                    nx, ny = x + dx, y + dy
-
-                    if (0 <= nx < width and 0 <= ny < height and
-                        not visited[nx][ny]):
-                        visited[nx][ny] = True
-                        queue.append((nx, ny))
-    
-    def _colors_similar(self, color1, color2, tolerance):
-        """判断两个颜色是否相似"""
-        r_diff = abs(color1.red() - color2.red())
-        g_diff = abs(color1.green() - color2.green())
-        b_diff = abs(color1.blue() - color2.blue())
-        a_diff = abs(color1.alpha() - color2.alpha())
-        
-        return (r_diff <= tolerance and g_diff <= tolerance and 
-                b_diff <= tolerance and a_diff <= tolerance)
\ No newline at end of file
+            color = QColor(self.fill_color)
+            color.setAlpha(round(color.alpha() * self.fill_opacity / 100))
+            premultiplied = image.format() == QImage.Format.Format_ARGB32_Premultiplied
+            _source_over(pixels, region, color, premultiplied)
+    
+    def _similar_mask(self, pixels, start_x, start_y, premultiplied):
+        """与起点颜色相近的像素(布尔数组，每像素1字节)
+        
+        与 pixelColor 一致，在非预乘颜色上比较；按行分带计算，
+        整数中间数组只有一个带的大小，不随画布放大
+        """
+        if self.tolerance <= 0:
+            # 精确匹配: 把每个像素看作一个 uint32 直接比较，无需拆分通道和反预乘
+            # (预乘值与非预乘颜色一一对应，比较结果相同)
+            packed = pixels.view(np.uint32)[..., 0]
+            return packed == packed[start_y, start_x]
+        
+        height = pixels.shape[0]
+        similar = np.empty(pixels.shape[:2], dtype=bool)
+        target = self._straight(pixels[start_y:start_y + 1, start_x:start_x + 1], premultiplied)[0, 0]
+        band = ImageProcessor.ADJUST_BAND_ROWS
+        for y in range(0, height, band):
+            colors = self._straight(pixels[y:y + band], premultiplied)
+            similar[y:y + band] = _within_tolerance(colors, target, self.tolerance)
+        return similar
+    
+    @staticmethod
+    def _straight(pixels, premultiplied):
+        """BGRA像素转换为非预乘的 int32 数组"""
+        colors = pixels.astype(np.int32)
+        if premultiplied:
+            alpha = colors[..., 3:]
+            colors[..., :3] = np.where(alpha > 0, (colors[..., :3] * 255 + alpha // 2) // np.maximum(alpha, 1), 0)
+        return colors
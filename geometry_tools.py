@@ -1,32 +1,164 @@
 # geometry_tools.py - 几何形状工具
-from PyQt6.QtCore import Qt, QPointF, QRect, QPoint
-from PyQt6.QtGui import QColor, QPen, QPainter, QBrush, QPainterPath, QImage, QPixmap
-import math
-from base_tool import BaseTool
+from PyQt6.QtCore import Qt, QPointF, QRect, QPoint, QTimer
+from PyQt6.QtGui import QColor, QPen, QPainter, QBrush, QPainterPath, QPixmap, QPolygon
+from functools import lru_cache
+import numpy as np
+from base_tool import BaseTool, BUTTON_LEFT, CONSTRAINT_SQUARE, CONSTRAINT_LINE
+
+# 预览相对用户不透明度的比例
+PREVIEW_OPACITY = 0.5
+
+# Catmull-Rom 样条的系数矩阵: 点 = 0.5 * [1, t, t^2, t^3] @ M @ [P0, P1, P2, P3]
+_CATMULL_ROM = 0.5 * np.array(((0, 2, 0, 0),
+                               (-1, 0, 1, 0),
+                               (2, -5, 4, -1),
+                               (-1, 3, -3, 1)), dtype=np.float64)
+
+
+@lru_cache(maxsize=8)
+def _catmull_rom_basis(num_points):
+    """每段 num_points + 1 个采样点(含两端)的权重矩阵 (采样数, 4)"""
+    t = np.linspace(0.0, 1.0, num_points + 1)
+    powers = np.stack((np.ones_like(t), t, t * t, t * t * t), axis=1)
+    basis = powers @ _CATMULL_ROM
+    basis.flags.writeable = False
+    return basis
+
+
+@lru_cache(maxsize=256)
+def _make_pen(rgba, width, clear):
+    """按(颜色, 宽度)缓存配置好的描边画笔 - 拖动预览每帧都要设置，避免重复构造"""
+    if clear:
+        return QPen(QColor(0, 0, 0, 0), width)
+    pen = QPen(QColor.fromRgba(rgba), width)
+    pen.setCapStyle(Qt.PenCapStyle.RoundCap)
+    pen.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
+    return pen
+
+
+@lru_cache(maxsize=256)
+def _make_brush(rgba):
+    """按颜色缓存填充画刷"""
+    return QBrush(QColor.fromRgba(rgba))
+
+
+class _PreviewBuffer:
+    """复用的画布尺寸预览 QPixmap - 直接在其上绘制，每帧只清除上一帧绘制过的区域，
+    不再每帧分配图像、整幅清零并转换为 QPixmap
+
+    只在一次拖动/编辑期间复用；提交或取消后应调用 release()，
+    否则每个工具(每个文档各有一套)都会一直占用一幅画布大小的缓冲区
+    """
+
+    def __init__(self):
+        self.pixmap = None
+        self.dirty = None  # 上一帧绘制内容的包围矩形
+
+    def begin(self, size):
+        """开始绘制新的一帧，返回已清除上一帧内容的 painter，失败时返回 None"""
+        if self.pixmap is None or self.pixmap.size() != size:
+            self.pixmap = QPixmap(size)
+            if self.pixmap.isNull():
+                self.pixmap = None
+                return None
+            self.pixmap.fill(Qt.GlobalColor.transparent)
+            self.dirty = None
+
+        painter = QPainter()
+        if not painter.begin(self.pixmap):
+            return None
+        if self.dirty is not None:
+            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+            painter.fillRect(self.dirty, Qt.GlobalColor.transparent)
+            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
+        return painter
+
+    def finish(self, painter, dirty):
+        """结束绘制并记录本帧的包围矩形，返回作为 temp_pixmap 显示的 QPixmap"""
+        painter.end()
+        self.dirty = dirty
+        return self.pixmap
+
+    def release(self):
+        """释放缓冲区，下次预览时重新分配"""
+        self.pixmap = None
+        self.dirty = None
+
+
+# 五角星10个顶点在单位圆上的方向(外、内顶点交替，y轴向下)
+_STAR_ANGLES = np.pi / 2 + np.arange(10) * np.pi / 5
+_STAR_UNIT = np.stack((np.cos(_STAR_ANGLES), -np.sin(_STAR_ANGLES)), axis=1)
+_STAR_OUTER = (np.arange(10) % 2 == 0)[:, None]
+
+
+@lru_cache(maxsize=32)
+def _polygon_unit(sides):
+    """正多边形各顶点在单位圆上的方向 (sides, 2) - 按边数缓存"""
+    angles = np.radians(90 + np.arange(sides) * (360 / sides))
+    unit = np.stack((np.cos(angles), np.sin(angles)), axis=1)
+    unit.flags.writeable = False
+    return unit
+
+
+def _polygon(points):
+    """整数坐标点列表转换为 QPolygon，用于一次 drawPolyline 绘制整条折线"""
+    return QPolygon([QPoint(x, y) for x, y in points])
+
+
+# 颜色是否透明 -> 合成模式: 透明色表示擦除
+_COMPOSITION = {
+    True: QPainter.CompositionMode.CompositionMode_Clear,
+    False: QPainter.CompositionMode.CompositionMode_SourceOver,
+}
+
+
+def _apply_fill_style(painter, color, opacity):
+    """设置填充画刷 - 透明色表示擦除(按完全不透明清除)"""
+    clear = color.alpha() == 0
+    painter.setCompositionMode(_COMPOSITION[clear])
+    painter.setBrush(_make_brush(0 if clear else color.rgba()))
+    painter.setOpacity(1.0 if clear else opacity)
+
+
+def _apply_stroke_style(painter, color, size, opacity):
+    """设置描边画笔 - 透明色表示擦除(按完全不透明清除)"""
+    clear = color.alpha() == 0
+    painter.setCompositionMode(_COMPOSITION[clear])
+    painter.setPen(_make_pen(0 if clear else color.rgba(), size, clear))
+    painter.setOpacity(1.0 if clear else opacity)
 
 
 class ShapeDrawingTool(BaseTool):
     """几何形状绘制工具基类"""
+    # Shift 拖动时使用的约束类型，子类可覆盖
+    _constraint_kind = CONSTRAINT_SQUARE
+    PREVIEW_DELAY_MS = 16  # 移动事件合并到下一帧绘制预览
+
+    def __init__(self, controller):
+        super().__init__(controller)
+        self._preview = _PreviewBuffer()
+        self._preview_scheduled = False
+        self._ibbox = (0, 0, 0, 0)  # 起点和终点的整数包围盒 (x1, y1, x2, y2)
+
     def mouse_press(self, event, image_pos):
         super().mouse_press(event, image_pos)
         if event.button() in (Qt.MouseButton.LeftButton, Qt.MouseButton.RightButton):
             self.start_pos = QPointF(image_pos.x(), image_pos.y())
-            self.end_pos = self.start_pos
+            self._set_end_pos(self.start_pos)
             self.drawing = True
             self._draw_preview()
 
-    def mouse_move(self, event, image_pos):
-        super().mouse_move(event, image_pos)
+    def _do_move(self, event, image_pos):
+        super()._do_move(event, image_pos)
         if self.drawing and event.buttons():
-            self.end_pos = QPointF(image_pos.x(), image_pos.y())
-            if self.tool_state['is_shift_pressed']:
+            x, y = image_pos.x(), image_pos.y()
+            if self.is_shift_pressed:
                 x, y = self._apply_constraint(
-                    self.start_pos.x(), self.start_pos.y(),
-                    self.end_pos.x(), self.end_pos.y(),
-                    self._get_constraint_type()
+                    self.start_pos.x(), self.start_pos.y(), x, y,
+                    self._constraint_kind
                 )
-                self.end_pos = QPointF(x, y)
-            self._draw_preview()
+            self._set_end_pos(QPointF(x, y))
+            self._schedule_preview()
 
     def mouse_release(self, event, image_pos):
         super().mouse_release(event, image_pos)
@@ -39,18 +171,26 @@ class ShapeDrawingTool(BaseTool):
                     self.controller.canvas.update()
             self.reset_states()
 
-    def key_press(self, event):
-        """处理按键事件"""
-        if event.key() == Qt.Key.Key_Escape:
-            self.cancel()
-            return True
-        return False
-
-    def _get_constraint_type(self):
-        return 'square'
-
     def _should_fill(self):
-        return self.tool_state['is_ctrl_pressed']
+        return self.is_ctrl_pressed
+
+    def _set_end_pos(self, pos):
+        """设置终点，并在位置改变时计算一次整数包围盒，预览的每一帧直接使用"""
+        self.end_pos = pos
+        sx, sy, ex, ey = self.start_pos.x(), self.start_pos.y(), pos.x(), pos.y()
+        self._ibbox = (int(min(sx, ex)), int(min(sy, ey)), int(max(sx, ex)), int(max(sy, ey)))
+
+    def _schedule_preview(self):
+        """在下一帧绘制预览，同一帧内的多次移动只绘制最后的位置"""
+        if not self._preview_scheduled:
+            self._preview_scheduled = True
+            QTimer.singleShot(self.PREVIEW_DELAY_MS, self._flush_preview)
+
+    def _flush_preview(self):
+        """绘制合并后的预览 - 期间已释放或取消时不再绘制"""
+        self._preview_scheduled = False
+        if self.drawing:
+            self._draw_preview()
 
     def _draw_preview(self):
         """绘制预览"""
@@ -68,74 +208,21 @@ class ShapeDrawingTool(BaseTool):
         if canvas_size.width() <= 0 or canvas_size.height() <= 0:
             return
 
-        # 创建临时图像
-        temp_image = QImage(canvas_size, QImage.Format.Format_ARGB32_Premultiplied)
-        if temp_image.isNull():
-            return
-
-        temp_image.fill(QColor(0, 0, 0, 0))
-
-        # 创建 QPainter
-        painter = QPainter()
-        if not painter.begin(temp_image):
+        # 复用预览缓冲区，只清除上一帧的区域
+        painter = self._preview.begin(canvas_size)
+        if painter is None:
             return
 
+        # 所有形状都在起点和终点的包围矩形内
+        dirty = self._stroke_rect(self.start_pos, self.end_pos, self.controller.get_current_size())
         try:
             painter.setRenderHint(QPainter.RenderHint.Antialiasing)
 
-            size = self.controller.get_current_size()
-            user_opacity = self.controller.get_current_opacity() / 100.0
-            preview_opacity = user_opacity * 0.5
-
-            border_color = self._get_drawing_color()
-            fill_color = self.controller.get_current_bg_color() if self.tool_state['mouse_button'] == 'left' else self.controller.get_current_fg_color()
-
-            # 处理透明色：透明色表示擦除
-            if fill_color.alpha() == 0:
-                painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
-                painter.setBrush(QBrush(QColor(0, 0, 0, 0)))
-                painter.setOpacity(1.0)
-            else:
-                painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
-                painter.setBrush(QBrush(fill_color))
-                painter.setOpacity(preview_opacity)
-
-            if self._should_fill():
-                painter.setPen(Qt.PenStyle.NoPen)
-                self._draw_shape(painter)
-
-                if size > 0:
-                    painter.setBrush(Qt.BrushStyle.NoBrush)
-                    if border_color.alpha() == 0:
-                        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
-                        painter.setPen(QPen(QColor(0, 0, 0, 0), size))
-                        painter.setOpacity(1.0)
-                    else:
-                        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
-                        pen = QPen(border_color, size)
-                        pen.setCapStyle(Qt.PenCapStyle.RoundCap)
-                        pen.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
-                        painter.setPen(pen)
-                        painter.setOpacity(preview_opacity)
-                    self._draw_shape(painter)
-            else:
-                painter.setBrush(Qt.BrushStyle.NoBrush)
-                if border_color.alpha() == 0:
-                    painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
-                    painter.setPen(QPen(QColor(0, 0, 0, 0), size))
-                    painter.setOpacity(1.0)
-                else:
-                    painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
-                    pen = QPen(border_color, size)
-                    pen.setCapStyle(Qt.PenCapStyle.RoundCap)
-                    pen.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
-                    painter.setPen(pen)
-                    painter.setOpacity(preview_opacity)
-                self._draw_shape(painter)
+            opacity = self.controller.get_current_opacity() / 100.0 * PREVIEW_OPACITY
+            self._paint(painter, opacity)
         finally:
-            painter.end()
+            self.controller.temp_pixmap = self._preview.finish(painter, dirty)
 
-        self.controller.temp_pixmap = QPixmap.fromImage(temp_image)
         if self.controller.canvas:
             self.controller.canvas.update()
 
@@ -143,67 +230,41 @@ class ShapeDrawingTool(BaseTool):
         """由子类实现具体的形状绘制"""
         pass
 
-    def _commit(self):
-        def draw_shape(painter):
-            size = self.controller.get_current_size()
-            user_opacity = self.controller.get_current_opacity() / 100.0
+    def _paint(self, painter, opacity):
+        """按当前颜色和大小填充/描边形状 - 预览和提交共用"""
+        size = self.controller.get_current_size()
+        border_color = self._get_drawing_color()
+
+        if self._should_fill():
+            fill_color = self.controller.get_current_bg_color() if self.mouse_button == BUTTON_LEFT else self.controller.get_current_fg_color()
+            _apply_fill_style(painter, fill_color, opacity)
+            painter.setPen(Qt.PenStyle.NoPen)
+            self._draw_shape(painter)
+            if size <= 0:
+                return
 
-            border_color = self._get_drawing_color()
-            fill_color = self.controller.get_current_bg_color() if self.tool_state['mouse_button'] == 'left' else self.controller.get_current_fg_color()
+        painter.setBrush(Qt.BrushStyle.NoBrush)
+        _apply_stroke_style(painter, border_color, size, opacity)
+        self._draw_shape(painter)
 
+    def _commit(self):
+        def draw_shape(painter):
             painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-
-            if self._should_fill():
-                # 处理填充颜色
-                if fill_color.alpha() == 0:
-                    painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
-                    painter.setBrush(QBrush(QColor(0, 0, 0, 0)))
-                    painter.setOpacity(1.0)
-                else:
-                    painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
-                    painter.setBrush(QBrush(fill_color))
-                    painter.setOpacity(user_opacity)
-
-                painter.setPen(Qt.PenStyle.NoPen)
-                self._draw_shape(painter)
-
-                if size > 0:
-                    painter.setBrush(Qt.BrushStyle.NoBrush)
-                    if border_color.alpha() == 0:
-                        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
-                        painter.setPen(QPen(QColor(0, 0, 0, 0), size))
-                        painter.setOpacity(1.0)
-                    else:
-                        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
-                        pen = QPen(border_color, size)
-                        pen.setCapStyle(Qt.PenCapStyle.RoundCap)
-                        pen.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
-                        painter.setPen(pen)
-                        painter.setOpacity(user_opacity)
-                    self._draw_shape(painter)
-            else:
-                painter.setBrush(Qt.BrushStyle.NoBrush)
-                if border_color.alpha() == 0:
-                    painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
-                    painter.setPen(QPen(QColor(0, 0, 0, 0), size))
-                    painter.setOpacity(1.0)
-                else:
-                    painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
-                    pen = QPen(border_color, size)
-                    pen.setCapStyle(Qt.PenCapStyle.RoundCap)
-                    pen.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
-                    painter.setPen(pen)
-                    painter.setOpacity(user_opacity)
-                self._draw_shape(painter)
+            self._paint(painter, self.controller.get_current_opacity() / 100.0)
 
         save_history = True
         self.controller.draw_on_active_layer(draw_shape, save_history)
+        self._preview.release()
+
+    def cancel(self):
+        """取消绘制并释放预览缓冲区"""
+        super().cancel()
+        self._preview.release()
 
 
 class LineTool(ShapeDrawingTool):
     """直线工具"""
-    def _get_constraint_type(self):
-        return 'line'
+    _constraint_kind = CONSTRAINT_LINE
 
     def _draw_shape(self, painter):
         if self.start_pos and self.end_pos:
@@ -215,10 +276,7 @@ class RectangleTool(ShapeDrawingTool):
     """矩形工具"""
     def _draw_shape(self, painter):
         if self.start_pos and self.end_pos:
-            x1 = int(min(self.start_pos.x(), self.end_pos.x()))
-            y1 = int(min(self.start_pos.y(), self.end_pos.y()))
-            x2 = int(max(self.start_pos.x(), self.end_pos.x()))
-            y2 = int(max(self.start_pos.y(), self.end_pos.y()))
+            x1, y1, x2, y2 = self._ibbox
 
             # 防止零尺寸
             if x2 - x1 < 1 or y2 - y1 < 1:
@@ -231,10 +289,7 @@ class EllipseTool(ShapeDrawingTool):
     """椭圆工具"""
     def _draw_shape(self, painter):
         if self.start_pos and self.end_pos:
-            x1 = int(min(self.start_pos.x(), self.end_pos.x()))
-            y1 = int(min(self.start_pos.y(), self.end_pos.y()))
-            x2 = int(max(self.start_pos.x(), self.end_pos.x()))
-            y2 = int(max(self.start_pos.y(), self.end_pos.y()))
+            x1, y1, x2, y2 = self._ibbox
 
             # 防止零尺寸
             if x2 - x1 < 1 or y2 - y1 < 1:
@@ -254,32 +309,18 @@ class StarTool(ShapeDrawingTool):
             if abs(x2 - x1) < 1 or abs(y2 - y1) < 1:
                 return
 
-            center_x, center_y = (x1 + x2) / 2, (y1 + y2) / 2
+            center = ((x1 + x2) / 2, (y1 + y2) / 2)
             outer_rx = abs(x2 - x1) / 2
             outer_ry = abs(y2 - y1) / 2
             inner_rx = max(outer_rx * 0.38, 1)  # 确保不为0
             inner_ry = max(outer_ry * 0.38, 1)  # 确保不为0
 
-            points = []
-            for i in range(10):
-                angle = math.pi / 2 + i * math.pi / 5
-                if i % 2 == 0:
-                    px = center_x + outer_rx * math.cos(angle)
-                    py = center_y - outer_ry * math.sin(angle)
-                else:
-                    px = center_x + inner_rx * math.cos(angle)
-                    py = center_y - inner_ry * math.sin(angle)
-                points.append(QPoint(int(px), int(py)))
-
-            if len(points) >= 10:
-                # 使用QPainterPath来绘制多边形，避免QPolygon兼容性问题
-                path = QPainterPath()
-                if points:
-                    path.moveTo(points[0].x(), points[0].y())
-                    for point in points[1:]:
-                        path.lineTo(point.x(), point.y())
-                    path.closeSubpath()
-                painter.drawPath(path)
+            # 预先算好的单位方向按外/内半径缩放
+            radii = np.where(_STAR_OUTER, (outer_rx, outer_ry), (inner_rx, inner_ry))
+            points = (center + _STAR_UNIT * radii).astype(np.int32)
+
+            # 整数顶点的闭合多边形走光栅引擎的多边形快速路径，无需通用路径细分
+            painter.drawPolygon(_polygon(points.tolist()))
 
 
 class PolygonTool(ShapeDrawingTool):
@@ -300,37 +341,19 @@ class PolygonTool(ShapeDrawingTool):
             # 确保多边形边数有效
             sides = max(3, min(self.polygon_sides, 20))  # 限制在3-20边之间
 
-            center_x, center_y = (x1 + x2) / 2, (y1 + y2) / 2
-            radius_x = abs(x2 - x1) / 2
-            radius_y = abs(y2 - y1) / 2
-
-            points = []
-            for i in range(sides):
-                angle_deg = 90 + i * (360 / sides)
-                angle_rad = math.radians(angle_deg)
-                px = center_x + radius_x * math.cos(angle_rad)
-                py = center_y + radius_y * math.sin(angle_rad)
-                points.append(QPoint(int(px), int(py)))
-
-            if len(points) >= 3:
-                # 使用QPainterPath来绘制多边形，避免QPolygon兼容性问题
-                path = QPainterPath()
-                if points:
-                    path.moveTo(points[0].x(), points[0].y())
-                    for point in points[1:]:
-                        path.lineTo(point.x(), point.y())
-                    path.closeSubpath()
-                painter.drawPath(path)
+            center = ((x1 + x2) / 2, (y1 + y2) / 2)
+            radius = (abs(x2 - x1) / 2, abs(y2 - y1) / 2)
+            points = (center + _polygon_unit(sides) * radius).astype(np.int32)
+
+            # 整数顶点的闭合多边形走光栅引擎的多边形快速路径，无需通用路径细分
+            painter.drawPolygon(_polygon(points.tolist()))
 
 
 class RoundedRectTool(ShapeDrawingTool):
     """圆角矩形工具"""
     def _draw_shape(self, painter):
         if self.start_pos and self.end_pos:
-            x1 = int(min(self.start_pos.x(), self.end_pos.x()))
-            y1 = int(min(self.start_pos.y(), self.end_pos.y()))
-            x2 = int(max(self.start_pos.x(), self.end_pos.x()))
-            y2 = int(max(self.start_pos.y(), self.end_pos.y()))
+            x1, y1, x2, y2 = self._ibbox
 
             # 防止零尺寸
             if x2 - x1 < 1 or y2 - y1 < 1:
@@ -342,6 +365,13 @@ class RoundedRectTool(ShapeDrawingTool):
 
 class CurveTool(BaseTool):
     """曲线工具 - 使用Catmull-Rom样条"""
+    _KEY_HANDLERS = {
+        **BaseTool._KEY_HANDLERS,
+        Qt.Key.Key_C: '_toggle_closed',
+        Qt.Key.Key_Enter: '_commit_curve',
+        Qt.Key.Key_Return: '_commit_curve',
+    }
+
     def __init__(self, controller):
         super().__init__(controller)
         self.control_points = []
@@ -349,6 +379,7 @@ class CurveTool(BaseTool):
         self.drawing_color = None
         self.is_closed = False
         self.initial_button = None
+        self._preview = _PreviewBuffer()
 
     def mouse_press(self, event, image_pos):
         super().mouse_press(event, image_pos)
@@ -385,59 +416,31 @@ class CurveTool(BaseTool):
         """处理按键事件"""
         if not self.is_drawing:
             return False
+        return super().key_press(event)
 
-        if event.key() == Qt.Key.Key_C:
-            self.is_closed = not self.is_closed
-            self._update_preview()
-            if self.controller and hasattr(self.controller, 'status_updated'):
-                self.controller.status_updated.emit(f"曲线{'已封闭' if self.is_closed else '已开放'}")
-            return True
-        elif event.key() == Qt.Key.Key_Enter or event.key() == Qt.Key.Key_Return:
-            self._commit_curve()
-            return True
-        elif event.key() == Qt.Key.Key_Escape:
-            self.cancel()
-            return True
-
-        return False
+    def _toggle_closed(self):
+        """切换封闭/开放曲线"""
+        self.is_closed = not self.is_closed
+        self._update_preview()
+        if self.controller and hasattr(self.controller, 'status_updated'):
+            self.controller.status_updated.emit(f"曲线{'已封闭' if self.is_closed else '已开放'}")
 
     def _catmull_rom_spline(self, points, closed=False, num_points=20):
-        """生成Catmull-Rom样条曲线"""
+        """生成Catmull-Rom样条曲线 - 所有段的采样点一次矩阵运算求出"""
         if len(points) < 2:
             return []
 
-        result = []
-        n = len(points)
-
+        pts = np.asarray(points, dtype=np.float64)
         if closed:
-            pts = [(points[-1][0], points[-1][1])] + points + [(points[0][0], points[0][1]), (points[1][0], points[1][1])]
+            pts = np.concatenate((pts[-1:], pts, pts[:2]))
         else:
-            pts = [(points[0][0], points[0][1])] + points + [(points[-1][0], points[-1][1])]
-
-        for i in range(1 if closed else 1, n + (1 if closed else 0)):
-            p0 = pts[i-1]
-            p1 = pts[i]
-            p2 = pts[i+1]
-            p3 = pts[i+2]
-
-            for t in range(num_points + 1):
-                t_norm = t / num_points
-                t2 = t_norm * t_norm
-                t3 = t2 * t_norm
-
-                x = 0.5 * ((2 * p1[0]) +
-                           (-p0[0] + p2[0]) * t_norm +
-                           (2*p0[0] - 5*p1[0] + 4*p2[0] - p3[0]) * t2 +
-                           (-p0[0] + 3*p1[0] - 3*p2[0] + p3[0]) * t3)
-
-                y = 0.5 * ((2 * p1[1]) +
-                           (-p0[1] + p2[1]) * t_norm +
-                           (2*p0[1] - 5*p1[1] + 4*p2[1] - p3[1]) * t2 +
-                           (-p0[1] + 3*p1[1] - 3*p2[1] + p3[1]) * t3)
+            pts = np.concatenate((pts[:1], pts, pts[-1:]))
 
-                result.append((int(x), int(y)))
-
-        return result
+        # 每段的4个控制点 (段数, 4, 2)
+        segments = np.stack((pts[:-3], pts[1:-2], pts[2:-1], pts[3:]), axis=1)
+        basis = _catmull_rom_basis(num_points)  # (采样数, 4)
+        curve = np.matmul(basis, segments)  # (段数, 采样数, 2)
+        return list(map(tuple, curve.reshape(-1, 2).astype(np.int32).tolist()))
 
     def _update_preview(self):
         """更新预览"""
@@ -455,56 +458,41 @@ class CurveTool(BaseTool):
         if canvas_size.width() <= 0 or canvas_size.height() <= 0:
             return
 
-        # 创建临时图像
-        temp_image = QImage(canvas_size, QImage.Format.Format_ARGB32_Premultiplied)
-        if temp_image.isNull():
-            return
-
-        temp_image.fill(QColor(0, 0, 0, 0))
-
-        # 创建 QPainter
-        painter = QPainter()
-        if not painter.begin(temp_image):
+        # 复用预览缓冲区，只清除上一帧的区域
+        painter = self._preview.begin(canvas_size)
+        if painter is None:
             return
 
+        size = self.controller.get_current_size()
+        dirty = QRect(QPoint(0, 0), canvas_size)  # 绘制中途出错时下一帧清除整幅
         try:
             painter.setRenderHint(QPainter.RenderHint.Antialiasing)
 
-            size = self.controller.get_current_size()
-            user_opacity = self.controller.get_current_opacity() / 100.0
-            preview_opacity = user_opacity * 0.5
+            preview_opacity = self.controller.get_current_opacity() / 100.0 * PREVIEW_OPACITY
 
             color = self.drawing_color if self.drawing_color else self.controller.get_current_fg_color()
+            _apply_stroke_style(painter, color, size, preview_opacity)
 
-            if color.alpha() == 0:
-                painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
-                painter.setPen(QPen(QColor(0, 0, 0, 0), size))
-                painter.setOpacity(1.0)
-            else:
-                painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
-                pen = QPen(color, size)
-                pen.setCapStyle(Qt.PenCapStyle.RoundCap)
-                pen.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
-                painter.setPen(pen)
-                painter.setOpacity(preview_opacity)
-
-            # 绘制控制点
-            for point in self.control_points:
-                painter.drawEllipse(QPointF(point[0], point[1]), 2, 2)
+            # 绘制控制点 - 合并为一条路径一次绘制
+            dots = QPainterPath()
+            for x, y in self.control_points:
+                dots.addEllipse(QPointF(x, y), 2, 2)
+            painter.drawPath(dots)
 
             # 绘制曲线
+            spline_points = []
             if len(self.control_points) >= 2:
                 spline_points = self._catmull_rom_spline(self.control_points, self.is_closed)
 
                 if spline_points:
-                    for i in range(len(spline_points) - 1):
-                        p1 = spline_points[i]
-                        p2 = spline_points[i + 1]
-                        painter.drawLine(p1[0], p1[1], p2[0], p2[1])
-        finally:
-            painter.end()
+                    painter.drawPolyline(_polygon(spline_points))
 
-        self.controller.temp_pixmap = QPixmap.fromImage(temp_image)
+            # 样条可能越出控制点的范围，包围矩形同时考虑两者
+            xs = [p[0] for p in self.control_points] + [p[0] for p in spline_points]
+            ys = [p[1] for p in self.control_points] + [p[1] for p in spline_points]
+            dirty = self._stroke_rect(QPointF(min(xs), min(ys)), QPointF(max(xs), max(ys)), max(size, 4))
+        finally:
+            self.controller.temp_pixmap = self._preview.finish(painter, dirty)
 
         if self.controller.canvas:
             self.controller.canvas.update()
@@ -519,18 +507,7 @@ class CurveTool(BaseTool):
             size = self.controller.get_current_size()
             user_opacity = self.controller.get_current_opacity() / 100.0
             color = self.drawing_color if self.drawing_color else self.controller.get_current_fg_color()
-
-            if color.alpha() == 0:
-                painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
-                painter.setPen(QPen(QColor(0, 0, 0, 0), size))
-                painter.setOpacity(1.0)
-            else:
-                painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
-                pen = QPen(color, size)
-                pen.setCapStyle(Qt.PenCapStyle.RoundCap)
-                pen.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
-                painter.setPen(pen)
-                painter.setOpacity(user_opacity)
+            _apply_stroke_style(painter, color, size, user_opacity)
 
             painter.setRenderHint(QPainter.RenderHint.Antialiasing)
 
@@ -538,13 +515,11 @@ class CurveTool(BaseTool):
                 spline_points = self._catmull_rom_spline(self.control_points, self.is_closed)
 
                 if spline_points:
-                    for i in range(len(spline_points) - 1):
-                        p1 = spline_points[i]
-                        p2 = spline_points[i + 1]
-                        painter.drawLine(p1[0], p1[1], p2[0], p2[1])
+                    painter.drawPolyline(_polygon(spline_points))
 
         save_history = True
         self.controller.draw_on_active_layer(draw_curve, save_history)
+        self._preview.release()
 
         self.control_points = []
         self.is_drawing = False
@@ -562,6 +537,7 @@ class CurveTool(BaseTool):
     def cancel(self):
         """取消绘制"""
         super().cancel()
+        self._preview.release()
         self.control_points = []
         self.is_drawing = False
         self.drawing_color = None
@@ -0,0 +1,392 @@
+# history_commands.py - 撤销/重做命令
+from collections import deque
+import numpy as np
+from PyQt6.QtCore import QRect
+from PyQt6.QtGui import QImage
+from history_tiles import CompressedTile
+from image_processor import ImageProcessor
+
+
+def xor_patches(image: QImage, patches):
+    """由修改前的像素和图像当前像素生成异或差分块
+    
+    patches 为 [(rect, 修改前像素的(H, W, 4)数组)]，数组会被原地改写为差分；
+    没有变化的块被丢弃。返回 [(rect, CompressedTile)]
+    """
+    pixels = ImageProcessor.qimage_array(image)
+    fmt = image.format()
+    result = []
+    for rect, before in patches:
+        x, y, w, h = rect.x(), rect.y(), rect.width(), rect.height()
+        np.bitwise_xor(before, pixels[y:y + h, x:x + w], out=before)
+        if before.any():
+            result.append((rect, CompressedTile.from_array(before, fmt)))
+    return result
+
+
+def _xor_into(image: QImage, rect: QRect, tile: CompressedTile):
+    """把差分块异或到图像上 - 在修改前/修改后两个状态之间切换"""
+    pixels = ImageProcessor.qimage_array(image, writable=True)
+    x, y, w, h = rect.x(), rect.y(), rect.width(), rect.height()
+    region = pixels[y:y + h, x:x + w]
+    np.bitwise_xor(region, tile.to_array(), out=region)
+
+
+class HistoryCommand:
+    """历史命令基类 - 只记录操作改变的内容
+    
+    revert() 撤销该操作，apply() 重新执行；两者总是交替调用，
+    所以命令可以在 revert() 时才记录重做所需的数据。
+    """
+    __slots__ = ()
+    
+    # 受影响的图像区域，None 表示需要完整刷新
+    dirty_rect = None
+    
+    # 命令占用的像素内存估计(字节)，入栈时计算一次
+    nbytes = 0
+    
+    # 已转存到磁盘的字节数 - 由数据本身决定，命令在撤销/重做栈之间移动时保持不变
+    spilled_nbytes = 0
+    
+    def spill(self, spill_file):
+        """把压缩的像素块转存到磁盘，返回写入的字节数；持有QImage的命令不支持"""
+        return 0
+    
+    def apply(self, controller):
+        raise NotImplementedError
+    
+    def revert(self, controller):
+        raise NotImplementedError
+
+
+class LayerPatchCommand(HistoryCommand):
+    """图层局部修改 - 只保存被修改区域的异或差分
+    
+    patches 为 [(rect, 差分块CompressedTile)]，一次笔画可由多个块组成。
+    差分 = 修改前 XOR 修改后，再异或一次即可在两个状态间切换，
+    撤销和重做共用同一份数据；笔画外未变的像素差分为0，压缩后几乎不占空间
+    """
+    __slots__ = ('index', 'patches')
+    
+    def __init__(self, index, patches):
+        self.index = index
+        self.patches = patches
+    
+    @property
+    def dirty_rect(self):
+        rect = QRect()
+        for patch_rect, _ in self.patches:
+            rect = rect.united(patch_rect)
+        return rect
+    
+    @property
+    def nbytes(self):
+        return sum(tile.nbytes for _, tile in self.patches)
+    
+    @property
+    def spilled_nbytes(self):
+        return sum(tile.spilled_nbytes for _, tile in self.patches)
+    
+    def spill(self, spill_file):
+        return sum(tile.spill(spill_file) for _, tile in self.patches)
+    
+    def merge(self, other):
+        """并入紧接着的同图层修改 - 同一区域的两次差分异或后即为合并的差分
+        
+        只有按同一网格切分的块才能合并(矩形相同或不相交)，返回是否合并
+        """
+        if other.index != self.index:
+            return False
+        
+        known = {(r.x(), r.y(), r.width(), r.height()): i for i, (r, _) in enumerate(self.patches)}
+        for rect, tile in other.patches:
+            i = known.get((rect.x(), rect.y(), rect.width(), rect.height()))
+            if i is None:
+                self.patches.append((rect, tile))
+            else:
+                old = self.patches[i][1]
+                combined = np.bitwise_xor(old.to_array(), tile.to_array())
+                self.patches[i] = (rect, CompressedTile.from_array(combined, old.format))
+        return True
+    
+    def apply(self, controller):
+        image = controller.layers[self.index]['image']
+        for rect, tile in self.patches:
+            _xor_into(image, rect, tile)
+    
+    revert = apply
+
+
+class LayerStackCommand(HistoryCommand):
+    """图层列表变化(增删、移动、可见性等) - 图像按隐式共享保存，不复制像素"""
+    __slots__ = ('before', 'after')
+    
+    def __init__(self, before):
+        self.before = before
+        self.after = None
+    
+    @property
+    def nbytes(self):
+        # 图像与当前图层共享，但图层一旦被绘制就会分离，按全部图像估计
+        total = 0
+        for state in (self.before, self.after):
+            if state is not None:
+                total += sum(layer['image'].sizeInBytes() for layer in state[0])
+        return total
+    
+    def apply(self, controller):
+        controller._restore_layer_stack(self.after)
+    
+    def revert(self, controller):
+        self.after = controller._layer_stack_state()
+        controller._restore_layer_stack(self.before)
+
+
+class LayerInsertCommand(HistoryCommand):
+    """插入或删除一个图层 - 只保存该图层的引用和索引
+    
+    图层离开列表后不会再被修改，直接持有引用即可；列表中的图层字典
+    可能被其他命令换成副本，所以每次移出时都重新取得引用
+    """
+    __slots__ = ('index', 'layer', 'active_before', 'active_after')
+    
+    def __init__(self, index, layer, active_before, active_after):
+        self.index = index
+        self.layer = layer
+        self.active_before = active_before
+        self.active_after = active_after
+    
+    @property
+    def nbytes(self):
+        return self.layer['image'].sizeInBytes()
+    
+    def _insert(self, controller, active):
+        controller.layers.insert(self.index, self.layer)
+        controller.active_layer_index = active
+    
+    def _remove(self, controller, active):
+        self.layer = controller.layers.pop(self.index)
+        controller.active_layer_index = active
+
+
+class LayerAddCommand(LayerInsertCommand):
+    """添加图层"""
+    __slots__ = ()
+    
+    def apply(self, controller):
+        self._insert(controller, self.active_after)
+    
+    def revert(self, controller):
+        self._remove(controller, self.active_before)
+
+
+class LayerRemoveCommand(LayerInsertCommand):
+    """删除图层"""
+    __slots__ = ()
+    
+    def apply(self, controller):
+        self._remove(controller, self.active_after)
+    
+    def revert(self, controller):
+        self._insert(controller, self.active_before)
+
+
+class AdjustmentCommand(HistoryCommand):
+    """一次滑块拖动 - 记录调整值和前后图像的引用
+    
+    调整总是生成新的图层图像，旧图像本来就要被替换，保留引用不产生复制；
+    撤销/重做只需换回图像，无需重新计算
+    """
+    __slots__ = ('index', 'adj_type', 'old_value', 'new_value', 'before', 'after',
+                 'original', 'had_original')
+    
+    def __init__(self, index, adj_type, old_value, before, original, had_original):
+        self.index = index
+        self.adj_type = adj_type
+        self.old_value = old_value
+        self.new_value = old_value
+        self.before = before
+        self.after = None
+        self.original = original
+        self.had_original = had_original
+    
+    @property
+    def nbytes(self):
+        # 原始像素与控制器共享，只计算命令独自保留的前后图像
+        total = self.before.sizeInBytes()
+        if self.after is not None:
+            total += self.after.sizeInBytes()
+        return total
+    
+    def apply(self, controller):
+        controller.layers[self.index]['image'] = QImage(self.after)
+        controller._adjustment_values[self.adj_type] = self.new_value
+        controller._original_images[self.index] = self.original
+    
+    def revert(self, controller):
+        layer = controller.layers[self.index]
+        # 图层图像会被原地绘制，命令持有的必须是独立的共享副本
+        self.after = QImage(layer['image'])
+        layer['image'] = QImage(self.before)
+        controller._adjustment_values[self.adj_type] = self.old_value
+        if not self.had_original:
+            # 第一次调整之前图层没有原始像素缓存
+            controller._original_images.pop(self.index, None)
+
+
+class AdjustmentResetCommand(HistoryCommand):
+    """重置所有调整 - 图层回到原始像素，调整值清空"""
+    __slots__ = ('index', 'before', 'after', 'original', 'values')
+    
+    def __init__(self, index, before, original, values):
+        self.index = index
+        self.before = before
+        self.after = None
+        self.original = original
+        self.values = values
+    
+    @property
+    def nbytes(self):
+        total = self.before.sizeInBytes()
+        if self.after is not None:
+            total += self.after.sizeInBytes()
+        return total
+    
+    def apply(self, controller):
+        controller.layers[self.index]['image'] = QImage(self.after)
+        controller._original_images.pop(self.index, None)
+        controller._adjustment_values.clear()
+    
+    def revert(self, controller):
+        layer = controller.layers[self.index]
+        self.after = QImage(layer['image'])
+        layer['image'] = QImage(self.before)
+        controller._original_images[self.index] = self.original
+        controller._adjustment_values = dict(self.values)
+
+
+class HistoryTransaction:
+    """可能失败的操作的历史记录 - 调用 commit() 后命令才入栈
+    
+    用法: with controller._history_transaction(命令) as tx: ...; tx.commit()
+    没有提交(提前返回或抛出异常)时命令被丢弃，撤销栈和重做栈都不受影响
+    """
+    __slots__ = ('controller', 'command', 'committed')
+    
+    def __init__(self, controller, command):
+        self.controller = controller
+        self.command = command
+        self.committed = False
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        return False
+    
+    def commit(self):
+        if not self.committed:
+            self.committed = True
+            self.controller._push_command(self.command)
+
+
+class BoundedHistory:
+    """按条数和内存上限约束的命令栈
+    
+    超出内存上限时先把最早的命令的压缩块转存到 spill_file(若有)，
+    仍然超出或磁盘占用超过 max_spill_bytes 时丢弃最早的命令
+    """
+    __slots__ = ('max_bytes', 'max_entries', 'spill_file', 'max_spill_bytes',
+                 'current_bytes', 'spilled_bytes', '_entries', '_cold')
+    
+    def __init__(self, max_bytes, max_entries, spill_file=None, max_spill_bytes=0):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.spill_file = spill_file
+        self.max_spill_bytes = max_spill_bytes
+        self.current_bytes = 0
+        self.spilled_bytes = 0
+        self._entries = deque()  # (命令, 内存字节数估计, 转存到磁盘的字节数)
+        self._cold = 0  # 最早的 _cold 条命令已经转存过
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __bool__(self):
+        return bool(self._entries)
+    
+    def append(self, command):
+        """压入命令，返回因超出上限而丢弃的命令数
+        
+        从另一个栈移来的命令可能已经转存过，其磁盘占用随命令一起计入
+        """
+        size = command.nbytes
+        spilled = command.spilled_nbytes
+        self._entries.append((command, size, spilled))
+        self.current_bytes += size
+        self.spilled_bytes += spilled
+        return self.trim()
+    
+    def pop(self):
+        command, size, spilled = self._entries.pop()
+        self.current_bytes -= size
+        self.spilled_bytes -= spilled
+        self._cold = min(self._cold, len(self._entries))
+        return command
+    
+    def peek(self):
+        """返回最新的命令，栈为空时返回 None"""
+        return self._entries[-1][0] if self._entries else None
+    
+    def refresh_top(self):
+        """最新的命令被合并修改后重新估计其大小，返回因此丢弃的命令数"""
+        command, size, spilled = self._entries[-1]
+        new_size = command.nbytes
+        new_spilled = command.spilled_nbytes
+        self._entries[-1] = (command, new_size, new_spilled)
+        self.current_bytes += new_size - size
+        self.spilled_bytes += new_spilled - spilled
+        return self.trim()
+    
+    def trim(self):
+        """转存或丢弃最早的命令直到满足上限(至少保留最新的一条)，返回丢弃数"""
+        evicted = 0
+        entries = self._entries
+        while len(entries) > 1 and len(entries) > self.max_entries:
+            self._evict_oldest()
+            evicted += 1
+        
+        # 最新的命令可能马上被撤销或合并，不转存
+        if self.spill_file is not None:
+            while self.current_bytes > self.max_bytes and self._cold < len(entries) - 1:
+                command, size, spilled = entries[self._cold]
+                written = command.spill(self.spill_file)
+                new_size = command.nbytes
+                entries[self._cold] = (command, new_size, spilled + written)
+                self.current_bytes += new_size - size
+                self.spilled_bytes += written
+                self._cold += 1
+        
+        while len(entries) > 1 and (self.current_bytes > self.max_bytes
+                                    or self.spilled_bytes > self.max_spill_bytes):
+            self._evict_oldest()
+            evicted += 1
+        
+        # 丢弃的命令在文件中留下的空间超过仍在使用的数据时整理文件
+        if evicted and self.spill_file is not None:
+            self.spill_file.maybe_compact()
+        return evicted
+    
+    def _evict_oldest(self):
+        _, size, spilled = self._entries.popleft()
+        self.current_bytes -= size
+        self.spilled_bytes -= spilled
+        if self._cold:
+            self._cold -= 1
+    
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+        self.spilled_bytes = 0
+        self._cold = 0
@@ -0,0 +1,144 @@
+# history_tiles.py - 历史记录分块存储
+import mmap
+import tempfile
+import weakref
+import zlib
+import numpy as np
+
+# 分块边长(像素)
+TILE_SIZE = 128
+
+
+class CompressedTile:
+    """压缩保存的像素块 - 历史记录中的像素只在撤销/重做时才需要
+    
+    使用无损的 zlib 压缩原始像素(PNG会转换为非预乘格式，半透明像素有损失)；
+    小于 RAW_LIMIT 的块直接保存数组，避免压缩开销大于收益
+    """
+    __slots__ = ('width', 'height', 'format', 'data')
+    
+    RAW_LIMIT = 4096  # 字节
+    LEVEL = 1  # 速度优先，平坦/空白区域仍有很高的压缩率
+    
+    @classmethod
+    def from_array(cls, pixels, fmt):
+        """保存(H, W, 4)连续数组 - 小块直接持有该数组，调用方之后不能再修改它"""
+        tile = cls.__new__(cls)
+        tile.height, tile.width = pixels.shape[:2]
+        tile.format = fmt
+        tile.data = pixels if pixels.nbytes < cls.RAW_LIMIT else zlib.compress(pixels.data, cls.LEVEL)
+        return tile
+    
+    @property
+    def nbytes(self):
+        """占用的像素内存(字节)，已转存到磁盘的块不占内存"""
+        data = self.data
+        if isinstance(data, np.ndarray):
+            return data.nbytes
+        if isinstance(data, SpilledData):
+            return 0
+        return len(data)
+    
+    @property
+    def spilled_nbytes(self):
+        """转存在磁盘文件中的字节数"""
+        data = self.data
+        return data.length if isinstance(data, SpilledData) else 0
+    
+    def spill(self, spill_file):
+        """把压缩数据转存到磁盘文件，返回写入的字节数(未压缩的小块和已转存的块不处理)"""
+        if not isinstance(self.data, bytes):
+            return 0
+        length = len(self.data)
+        self.data = spill_file.write(self.data)
+        return length
+    
+    def to_array(self):
+        """解压为(H, W, 4)数组(未压缩的块直接返回，调用方不应修改)"""
+        data = self.data
+        if isinstance(data, np.ndarray):
+            return data
+        if isinstance(data, SpilledData):
+            data = data.read()
+        return np.frombuffer(zlib.decompress(data), np.uint8).reshape(self.height, self.width, 4)
+
+
+class SpilledData:
+    """转存在磁盘文件中的压缩数据 - 持有文件引用，文件在不再被引用时删除
+    
+    被回收时从文件的使用量中扣除；整理文件时 offset 会被更新
+    """
+    __slots__ = ('spill_file', 'offset', 'length', '__weakref__')
+    
+    def __init__(self, spill_file, offset, length):
+        self.spill_file = spill_file
+        self.offset = offset
+        self.length = length
+    
+    def __del__(self):
+        self.spill_file.live_bytes -= self.length
+    
+    def read(self):
+        return self.spill_file.read(self.offset, self.length)
+
+
+class SpillFile:
+    """历史记录的磁盘转存文件 - 追加写入，读取通过 mmap
+    
+    使用匿名临时文件，程序退出或对象被回收后自动删除。已丢弃记录留下的空间
+    超过仍在使用的数据(且文件足够大)时，把使用中的数据复制到新文件并换用之
+    """
+    COMPACT_MIN_BYTES = 64 * 1024 * 1024  # 小于此大小的文件不值得整理
+    
+    def __init__(self):
+        self._file = None
+        self._map = None
+        self._blocks = weakref.WeakSet()  # 仍被引用的 SpilledData
+        self.size = 0
+        self.live_bytes = 0
+    
+    def write(self, data) -> SpilledData:
+        self.maybe_compact()
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix='benben_history_')
+        offset = self.size
+        self._file.seek(offset)
+        self._file.write(data)
+        self.size += len(data)
+        self.live_bytes += len(data)
+        block = SpilledData(self, offset, len(data))
+        self._blocks.add(block)
+        return block
+    
+    def maybe_compact(self):
+        """已丢弃的空间超过使用中的数据时整理文件"""
+        dead = self.size - self.live_bytes
+        if self.size >= self.COMPACT_MIN_BYTES and dead > self.live_bytes:
+            self.compact()
+    
+    def compact(self):
+        """把仍被引用的数据按原顺序复制到新的临时文件，回收已丢弃记录的空间"""
+        blocks = sorted(self._blocks, key=lambda block: block.offset)
+        new_file = tempfile.TemporaryFile(prefix='benben_history_')
+        offset = 0
+        for block in blocks:
+            new_file.write(self.read(block.offset, block.length))
+            block.offset = offset
+            offset += block.length
+        
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+        self._file = new_file
+        self.size = offset
+    
+    def read(self, offset, length):
+        end = offset + length
+        if self._map is None or len(self._map) < end:
+            # 映射建立后又追加了数据，重新映射整个文件
+            self._file.flush()
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map[offset:end]
@@ -3,9 +3,30 @@ from PyQt6.QtGui import QImage, QColor, QPainter, QPen, QBrush
 from PyQt6.QtCore import Qt, QRect
 from PIL import Image, ImageFilter, ImageEnhance
 import numpy as np
-from functools import lru_cache
 import math
 
+# 可选依赖：OpenCV 的滤波实现使用SIMD，可用时优先使用，否则回退到PIL
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+
+# BGRA通道顺序下的亮度权重(与PIL的 L 模式转换一致)
+_LUMA_BGR = np.array((0.114, 0.587, 0.299), dtype=np.float32)
+
+# 与 ImageFilter.SHARPEN / ImageFilter.EMBOSS 效果相同的3x3卷积核
+# cv2.filter2D 做相关运算，而 PIL 按行翻转后应用核(第一行乘下一行像素)，
+# 因此这里的核是 PIL 核上下翻转后的形式；SHARPEN 上下对称，无需翻转
+_SHARPEN_KERNEL = np.array(((-2, -2, -2), (-2, 32, -2), (-2, -2, -2)), dtype=np.float32) / 16.0
+_EMBOSS_KERNEL = np.array(((0, 0, 0), (0, 1, 0), (-1, 0, 0)), dtype=np.float32)
+
+
+def _blend_quantize(band: np.ndarray) -> np.ndarray:
+    """原地截断到0-255并取整 - 与 Image.blend 写回8位时的处理相同(向下取整，不是四舍五入)"""
+    np.clip(band, 0.0, 255.0, out=band)
+    return np.floor(band, out=band)
+
 
 class ImageProcessor:
     """图像处理器 - 优化版"""
@@ -15,19 +36,94 @@ class ImageProcessor:
     DEFAULT_KERNEL = 9
     DEFAULT_BLOCK = 10
     MAX_KERNEL = 15
+    HAS_CV2 = cv2 is not None
+    ADJUST_BAND_ROWS = 64  # 融合调整按行分带处理，中间数组保持在缓存内
+    
+    @staticmethod
+    def qimage_array(qimage: QImage, writable: bool = False) -> np.ndarray:
+        """返回32位QImage像素的(H, W, 4) BGRA视图 - 不复制
+        
+        视图不持有QImage，调用方需保证qimage在使用期间存活；
+        只读视图使用 constBits，不会触发隐式共享的分离拷贝。
+        依赖 PyQt6 的 sip.voidptr 支持缓冲区协议(setsize 后可直接交给 np.frombuffer)；
+        视图不应跨事件缓存，图像被修改或分离后原缓冲区可能已经释放
+        """
+        if qimage.depth() != 32 and not qimage.isNull():
+            raise ValueError(f"需要32位图像，实际为 {qimage.format()}")
+        
+        ptr = qimage.bits() if writable else qimage.constBits()
+        if ptr is None:
+            return np.zeros((qimage.height(), qimage.width(), 4), dtype=np.uint8)
+        
+        ptr.setsize(qimage.sizeInBytes())
+        arr = np.frombuffer(ptr, np.uint8).reshape(qimage.height(), qimage.bytesPerLine() // 4, 4)
+        return arr[:, :qimage.width()]
+    
+    @staticmethod
+    def flood_region(similar: np.ndarray, x: int, y: int) -> np.ndarray:
+        """返回布尔数组 similar 中与 (x, y) 4连通的区域(布尔数组)"""
+        if not similar[y, x]:
+            return np.zeros_like(similar)
+        
+        if cv2 is not None:
+            grid = similar.astype(np.uint8)
+            mask = np.zeros((grid.shape[0] + 2, grid.shape[1] + 2), dtype=np.uint8)
+            cv2.floodFill(grid, mask, (x, y), 2, 0, 0, 4)
+            return grid == 2
+        
+        # 扫描线填充(Heckbert): 每次处理一整段连续像素，段的查找由NumPy完成。
+        # 种子记录来自哪一行(dy)和父段范围，回头扫描父行时只需检查超出父段的部分
+        height = similar.shape[0]
+        filled = np.zeros_like(similar)
+        seeds = [(x, y, 1, x, x)]  # (x, y, 方向, 父段左端, 父段右端)，起点没有父段
+        while seeds:
+            sx, sy, dy, parent_left, parent_right = seeds.pop()
+            if filled[sy, sx]:
+                continue
+            
+            row = similar[sy]
+            left = sx - ImageProcessor._run_length(row[sx::-1]) + 1
+            right = sx + ImageProcessor._run_length(row[sx:])
+            filled[sy, left:right] = True
+            
+            # 前进方向扫描整段；父行只扫描本段超出父段的两端
+            spans = [(sy + dy, left, right, dy)]
+            if left < parent_left:
+                spans.append((sy - dy, left, parent_left, -dy))
+            if right > parent_right:
+                spans.append((sy - dy, parent_right, right, -dy))
+            for ny, lo, hi, ndy in spans:
+                if 0 <= ny < height:
+                    open_ = similar[ny, lo:hi] & ~filled[ny, lo:hi]
+                    starts = np.flatnonzero(open_ & ~np.concatenate(([False], open_[:-1])))
+                    seeds.extend((lo + int(i), ny, ndy, left, right) for i in starts)
+        return filled
+    
+    @staticmethod
+    def _run_length(values: np.ndarray) -> int:
+        """布尔数组开头连续 True 的个数"""
+        stop = np.argmin(values)
+        return len(values) if values[stop] else int(stop)
     
     @staticmethod
-    @lru_cache(maxsize=32)
     def create_new_image(width: int, height: int, bg_color: QColor = None) -> QImage:
-        """创建新图像 - 缓存优化"""
+        """创建新图像 - 每次返回新的图像，归调用方所有
+        
+        不做缓存：缓存会把同一个 QImage 交给多个调用方(修改一个会影响其他)，
+        且每种尺寸都会一直占用整幅缓冲区；QColor 可变，也不适合作为缓存键
+        """
         bg_color = bg_color or QColor(Qt.GlobalColor.white)
         
         if not isinstance(bg_color, QColor):
             bg_color = QColor(bg_color)
         
-        fmt = QImage.Format.Format_ARGB32 if bg_color.alpha() == 0 else QImage.Format.Format_RGB32
+        if bg_color.alpha() == 0:
+            # 透明背景直接清零，无需按颜色转换像素值
+            image = QImage(width, height, QImage.Format.Format_ARGB32)
+            image.fill(0)
+            return image
         
-        image = QImage(width, height, fmt)
+        image = QImage(width, height, QImage.Format.Format_RGB32)
         image.fill(bg_color)
         return image
     
@@ -65,6 +161,60 @@ class ImageProcessor:
         """调整饱和度"""
         return ImageProcessor._enhance_image(image, value, 'saturation')
     
+    @staticmethod
+    def adjust_bgra(src: np.ndarray, dst: np.ndarray, brightness: int = 0,
+                    contrast: int = 0, saturation: int = 0) -> np.ndarray:
+        """亮度/对比度/饱和度融合调整 - src/dst为(H, W, 4) BGRA uint8数组
+        
+        按 亮度 -> 对比度 -> 饱和度 的顺序计算，每一步后截断取整，结果与依次调用
+        ImageEnhance 相同(误差不超过1)，但只遍历一次图像，alpha通道原样保留
+        """
+        br = 1.0 + brightness / 100.0
+        ct = 1.0 + contrast / 100.0
+        sat = 1.0 + saturation / 100.0
+        
+        dst[..., 3] = src[..., 3]
+        if br == 1.0 and ct == 1.0 and sat == 1.0:
+            dst[..., :3] = src[..., :3]
+            return dst
+        
+        step = ImageProcessor.ADJUST_BAND_ROWS
+        
+        # 与 ImageEnhance.Contrast 一致：以亮度调整(并截断)后灰度图的平均值为中心
+        mean = 0.0
+        if ct != 1.0:
+            if br == 1.0:
+                channel_mean = src[..., :3].mean(axis=(0, 1), dtype=np.float64)
+                luma_mean = float(channel_mean @ _LUMA_BGR)
+            else:
+                total = 0.0
+                for y in range(0, src.shape[0], step):
+                    band = src[y:y + step, :, :3].astype(np.float32)
+                    band *= br
+                    total += float((_blend_quantize(band) @ _LUMA_BGR).sum(dtype=np.float64))
+                luma_mean = total / max(1, src.shape[0] * src.shape[1])
+            mean = float(int(luma_mean + 0.5))
+        
+        for y in range(0, src.shape[0], step):
+            band = src[y:y + step, :, :3].astype(np.float32)
+            if br != 1.0:
+                band *= br
+                _blend_quantize(band)
+            if ct != 1.0:
+                band -= mean
+                band *= ct
+                band += mean
+                _blend_quantize(band)
+            if sat != 1.0:
+                # ImageEnhance.Color 的灰度图为L模式，灰度值四舍五入为整数
+                luma = np.floor(band @ _LUMA_BGR + 0.5)[..., None]
+                band -= luma
+                band *= sat
+                band += luma
+            dst[y:y + step, :, :3] = _blend_quantize(band)
+        
+        return dst
+    
     @staticmethod
     def apply_gaussian_blur(image: Image.Image, radius: int = DEFAULT_RADIUS) -> Image.Image:
         """高斯模糊 - 优化版"""
@@ -72,6 +222,10 @@ class ImageProcessor:
             if radius <= 0:
                 return image.copy()
             radius = min(radius, 10)
+            if cv2 is not None:
+                # PIL的radius即高斯标准差
+                blurred = cv2.GaussianBlur(np.asarray(image), (0, 0), radius)
+                return Image.fromarray(blurred, mode=image.mode)
             return image.filter(ImageFilter.GaussianBlur(radius=radius))
         except Exception as e:
             print(f"高斯模糊失败: {e}")
@@ -85,40 +239,70 @@ class ImageProcessor:
             if kernel_size % 2 == 0:
                 kernel_size += 1
             
+            if cv2 is not None:
+                return ImageProcessor._cv2_motion_blur(image, kernel_size)
             return ImageProcessor._simple_motion_blur(image, kernel_size)
-            
+        
         except Exception as e:
             print(f"运动模糊失败: {e}")
             return image.copy()
     
+    @staticmethod
+    def _cv2_motion_blur(image: Image.Image, kernel_size: int) -> Image.Image:
+        """OpenCV运动模糊 - 水平方向的一维线性卷积核，与原图按0.6混合"""
+        arr = np.asarray(image)
+        kernel = np.full((1, kernel_size), 1.0 / kernel_size, dtype=np.float32)
+        blurred = cv2.filter2D(arr, -1, kernel)
+        return Image.fromarray(cv2.addWeighted(arr, 0.4, blurred, 0.6, 0), mode=image.mode)
+    
     @staticmethod
     def _simple_motion_blur(image: Image.Image, kernel_size: int) -> Image.Image:
-        """简化的运动模糊"""
+        """无OpenCV时的运动模糊 - 与 _cv2_motion_blur 相同的水平一维均值卷积，与原图按0.6混合
+        
+        由累加和一次求出所有窗口的和，边缘按反射扩展(与 cv2 默认的 BORDER_REFLECT_101 相同)
+        """
         try:
             kernel_size = max(3, min(kernel_size, 15))
-            original = image.copy()
+            work = image if image.mode in ('L', 'RGB', 'RGBA') else image.convert('RGBA')
+            arr = np.asarray(work)
             
-            work = image.convert('RGBA') if image.mode != 'RGBA' else image.copy()
-            blur_radius = kernel_size // 3
+            radius = kernel_size // 2
+            kernel_size = 2 * radius + 1  # 窗口以像素为中心
+            pad = [(0, 0), (radius, radius)] + [(0, 0)] * (arr.ndim - 2)
+            sums = np.cumsum(np.pad(arr, pad, mode='reflect'), axis=1, dtype=np.int32)
             
-            result = work
-            for _ in range(3):
-                result = result.filter(ImageFilter.BoxBlur(blur_radius))
-            
-            if image.mode == 'RGBA':
-                blended = Image.blend(original.convert('RGBA'), result, alpha=0.6)
-                return blended.convert(image.mode) if image.mode != 'RGBA' else blended
-            else:
-                return Image.blend(original, result, alpha=0.6)
+            # 窗口和: S[x + k - 1] - S[x - 1]
+            window = sums[:, kernel_size - 1:].copy()
+            window[:, 1:] -= sums[:, :-kernel_size]
             
+            blended = arr * np.float32(0.4)
+            blended += window * np.float32(0.6 / kernel_size)
+            blended += 0.5  # 四舍五入
+            result = Image.fromarray(blended.astype(np.uint8), mode=work.mode)
+            return result if work is image else result.convert(image.mode)
+        
         except Exception as e:
             print(f"简化运动模糊失败: {e}")
             return image.copy()
     
+    @staticmethod
+    def _cv2_filter3x3(image: Image.Image, kernel: np.ndarray, delta: float = 0) -> Image.Image:
+        """OpenCV 3x3 卷积 - 最外一圈像素保持原值(PIL 不处理边缘)
+        
+        kernel 须为相关运算形式(PIL 核上下翻转)，见 _EMBOSS_KERNEL 处的说明
+        """
+        arr = np.asarray(image)
+        out = cv2.filter2D(arr, -1, kernel, delta=delta)
+        out[0], out[-1] = arr[0], arr[-1]
+        out[:, 0], out[:, -1] = arr[:, 0], arr[:, -1]
+        return Image.fromarray(out, mode=image.mode)
+    
     @staticmethod
     def apply_sharpen(image: Image.Image) -> Image.Image:
         """锐化"""
         try:
+            if cv2 is not None:
+                return ImageProcessor._cv2_filter3x3(image, _SHARPEN_KERNEL)
             return image.filter(ImageFilter.SHARPEN)
         except Exception as e:
             print(f"锐化失败: {e}")
@@ -128,6 +312,8 @@ class ImageProcessor:
     def apply_emboss(image: Image.Image) -> Image.Image:
         """浮雕"""
         try:
+            if cv2 is not None:
+                return ImageProcessor._cv2_filter3x3(image, _EMBOSS_KERNEL, delta=128)
             return image.filter(ImageFilter.EMBOSS)
         except Exception as e:
             print(f"浮雕失败: {e}")
@@ -135,29 +321,30 @@ class ImageProcessor:
     
     @staticmethod
     def apply_mosaic(image: Image.Image, block_size: int = DEFAULT_BLOCK) -> Image.Image:
-        """马赛克 - numpy优化版"""
+        """马赛克 - 分块求平均全部由 numpy 向量运算完成"""
         try:
             block_size = max(2, min(block_size, 50))
             
-            # 转换为numpy数组加速处理
-            arr = np.array(image)
+            arr = np.asarray(image)
             h, w = arr.shape[:2]
             
-            # 分块处理
-            for y in range(0, h, block_size):
-                for x in range(0, w, block_size):
-                    y_end = min(y + block_size, h)
-                    x_end = min(x + block_size, w)
-                    
-                    # 计算块的平均颜色
-                    block = arr[y:y_end, x:x_end]
-                    avg_color = block.mean(axis=(0, 1)).astype(np.uint8)
-                    
-                    # 填充块
-                    arr[y:y_end, x:x_end] = avg_color
-            
-            return Image.fromarray(arr, mode=image.mode)
+            # 所有块一次求和: 先按行分块累加，再按列分块累加；边缘的不完整块只统计实际像素
+            ys = np.arange(0, h, block_size)
+            xs = np.arange(0, w, block_size)
+            sums = np.add.reduceat(np.add.reduceat(arr, ys, axis=0, dtype=np.uint32), xs, axis=1)
+            rows = np.diff(ys, append=h)
+            cols = np.diff(xs, append=w)
+            counts = np.outer(rows, cols)
+            if arr.ndim == 3:
+                counts = counts[..., None]
+            avg = (sums / counts).astype(np.uint8)
             
+            # 每个块的平均颜色展开回原尺寸 - 按 (行, 列) 块号一次索引，每个输出像素只写一遍
+            row_block = np.repeat(np.arange(len(rows)), rows)
+            col_block = np.repeat(np.arange(len(cols)), cols)
+            out = avg[row_block[:, None], col_block]
+            return Image.fromarray(out, mode=image.mode)
+        
         except Exception as e:
             print(f"马赛克失败: {e}")
             return image.copy()
@@ -38,21 +38,9 @@ class DocumentSubWindow(QMdiSubWindow):
     
     def closeEvent(self, close_event):
         """重写关闭事件"""
-        if hasattr(self, 'controller') and self.controller.is_modified:
-            reply = QMessageBox.question(
-                self, '保存更改',
-                "当前图像已修改,是否保存?",
-                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No | QMessageBox.StandardButton.Cancel
-            )
-            
-            if reply == QMessageBox.StandardButton.Yes:
-                self.controller.save_file()
-                if self.controller.is_modified:  # 保存失败
-                    close_event.ignore()
-                    return
-            elif reply == QMessageBox.StandardButton.Cancel:
-                close_event.ignore()
-                return
+        if hasattr(self, 'controller') and not self.controller.check_save_before_close():
+            close_event.ignore()
+            return
         
         # 调用父类关闭事件
         super().closeEvent(close_event)
@@ -232,6 +220,12 @@ class MainWindow(QMainWindow):
             
             action = self._create_toolbar_action(icon_text, text, shortcut, callback)
             self.top_toolbar.addAction(action)
+            
+            # 记住撤销/重做按钮，控制器更新其状态时无需按文字查找
+            if text == "撤销":
+                self.undo_toolbar_action = action
+            elif text == "重做":
+                self.redo_toolbar_action = action
 
     def _create_toolbar_action(self, icon_text, text, shortcut, callback):
         """创建工具栏动作 - 简化版"""
@@ -926,7 +920,8 @@ class MainWindow(QMainWindow):
         sub_windows = self.mdi_area.subWindowList()
         
         for sub_window in sub_windows:
-            if hasattr(sub_window, 'controller') and sub_window.controller.is_modified:
+            controller = getattr(sub_window, 'controller', None)
+            if controller and (controller.is_modified or controller.has_pending_saves()):
                 # 激活该子窗口
                 self.mdi_area.setActiveSubWindow(sub_window)
                 
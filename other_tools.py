@@ -3,7 +3,7 @@ from PyQt6.QtCore import Qt, QPointF, QRect, QTimer
 from PyQt6.QtGui import QColor, QPen, QPainter, QBrush, QImage, QPixmap, QCursor, QFont, QFontMetrics
 from PyQt6.QtWidgets import QApplication, QInputDialog, QColorDialog
 import math
-from base_tool import BaseTool
+from base_tool import BaseTool, BUTTON_RIGHT
 
 
 class PickerTool(BaseTool):
@@ -34,8 +34,8 @@ class PickerTool(BaseTool):
 
                 # 根据鼠标按钮设置前景色或背景色
                 is_background = (event.button() == Qt.MouseButton.RightButton or
-                                self.tool_state['mouse_button'] == 'right' or
-                                self.tool_state['is_right_button_during_drag'])
+                                self.mouse_button == BUTTON_RIGHT or
+                                self.is_right_button_during_drag)
 
                 if is_background:
                     # 设置为背景色
@@ -127,7 +127,7 @@ class TextTool(BaseTool):
         preview_width = max(200, text_width + 20)
         preview_height = text_height + 20
 
-        preview_image = QImage(preview_width, preview_height, QImage.Format.Format_ARGB32)
+        preview_image = QImage(preview_width, preview_height, QImage.Format.Format_ARGB32_Premultiplied)
         preview_image.fill(QColor(0, 0, 0, 0))
 
         painter = QPainter(preview_image)
@@ -150,7 +150,7 @@ class TextTool(BaseTool):
         painter.end()
 
         # 更新工具预览
-        pixmap = QPixmap.fromImage(preview_image)
+        pixmap = QPixmap.fromImage(preview_image, Qt.ImageConversionFlag.NoFormatConversion)
         # 计算预览位置（画布坐标）
         preview_pos = QPointF(self.edit_position.x(), self.edit_position.y())
         self.controller.update_tool_preview(pixmap, preview_pos)
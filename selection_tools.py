@@ -36,6 +36,7 @@ class BaseSelectTool(BaseTool):
         self.transformed_corners = []
         self.rotate_handle_pos = None
         self.resize_handles = {}
+        self._resize_hit_boxes = ()     # (名称, x0, y0, x1, y1) 整数热区，移动时命中测试用
 
         # --- 视觉样式 ---
         self.border_color = QColor(0, 150, 255)
@@ -88,9 +89,9 @@ class BaseSelectTool(BaseTool):
         if event.button() == Qt.MouseButton.LeftButton and not self.is_floating:
             self._start_new_selection(x, y)
 
-    def mouse_move(self, event, image_pos):
+    def _do_move(self, event, image_pos):
         """鼠标移动事件"""
-        super().mouse_move(event, image_pos)
+        super()._do_move(event, image_pos)
         x, y = int(image_pos.x()), int(image_pos.y())
 
         # 更新光标（非操作状态）
@@ -121,7 +122,7 @@ class BaseSelectTool(BaseTool):
         # 绘制新选区预览
         elif self.drawing:
             self.end_pos = QPointF(x, y)
-            if self.tool_state['is_shift_pressed']:
+            if self.is_shift_pressed:
                 self._apply_square_constraint()
             self._update_preview()
 
@@ -350,13 +351,18 @@ class BaseSelectTool(BaseTool):
             'r': QRect(int(r_mid.x() - handle_size/2), int(r_mid.y() - handle_size/2), handle_size, handle_size),
         }
 
+        # 热区边界只在手柄变化时计算一次，鼠标移动时直接比较整数
+        hot_expand = 10
+        self._resize_hit_boxes = tuple(
+            (name, rect.left() - hot_expand, rect.top() - hot_expand,
+             rect.right() + hot_expand, rect.bottom() + hot_expand)
+            for name, rect in self.resize_handles.items()
+        )
+
     def _get_resize_handle_at(self, x, y):
         """获取鼠标所在位置的调整手柄"""
-        if not self.resize_handles:
-            return None
-        hot_expand = 10
-        for name, rect in self.resize_handles.items():
-            if rect.adjusted(-hot_expand, -hot_expand, hot_expand, hot_expand).contains(x, y):
+        for name, x0, y0, x1, y1 in self._resize_hit_boxes:
+            if x0 <= x <= x1 and y0 <= y <= y1:
                 return name
         return None
 
@@ -385,7 +391,7 @@ class BaseSelectTool(BaseTool):
         self._draw_hint(painter, "拖动创建选区，Shift=正方形/圆形")
         painter.end()
 
-        self.controller.temp_pixmap = QPixmap.fromImage(temp_image)
+        self.controller.temp_pixmap = QPixmap.fromImage(temp_image, Qt.ImageConversionFlag.NoFormatConversion)
         if self.controller.canvas:
             self.controller.canvas.update()
 
@@ -427,8 +433,8 @@ class BaseSelectTool(BaseTool):
         if self.selection_mask is None:
             return
 
-        # 2. 创建一个新的ARGB图像来存储选区内容
-        self.selected_content = QImage(self.selection_rect.size(), QImage.Format.Format_ARGB32)
+        # 2. 创建一个新的预乘ARGB图像来存储选区内容(与图层格式相同，绘制回图层时无需转换)
+        self.selected_content = QImage(self.selection_rect.size(), QImage.Format.Format_ARGB32_Premultiplied)
         self.selected_content.fill(QColor(0, 0, 0, 0))  # 填充完全透明
         
         # 3. 使用QPainter将原始内容和蒙版合并
@@ -448,7 +454,7 @@ class BaseSelectTool(BaseTool):
         """创建矩形选区的蒙版 (白色区域表示选中)"""
         if not self.selection_rect:
             return None
-        mask = QImage(self.selection_rect.size(), QImage.Format.Format_ARGB32)
+        mask = QImage(self.selection_rect.size(), QImage.Format.Format_ARGB32_Premultiplied)
         mask.fill(QColor(0, 0, 0, 0))  # 先填充透明
         painter = QPainter(mask)
         painter.fillRect(mask.rect(), QColor(255, 255, 255, 255))  # 再填充白色不透明
@@ -478,7 +484,7 @@ class BaseSelectTool(BaseTool):
         self._draw_hint(painter, "🔵移动 🔴缩放 🟢旋转 ⚪调整 Enter=提交 画布外单击=提交 其他操作=取消")
         painter.end()
 
-        self.controller.temp_pixmap = QPixmap.fromImage(temp_image)
+        self.controller.temp_pixmap = QPixmap.fromImage(temp_image, Qt.ImageConversionFlag.NoFormatConversion)
         if self.controller.canvas:
             self.controller.canvas.update()
 
@@ -656,9 +662,7 @@ class BaseSelectTool(BaseTool):
         if not self.is_floating or not self.selection_rect or self.selected_content is None:
             return
 
-        # 1. 保存历史记录
-        if hasattr(self.controller, 'save_to_history'):
-            self.controller.save_to_history()
+        # 1. 历史记录由 draw_on_active_layer 保存(只记录被修改的区域)
 
         # 2. 定义一个绘制函数，用于在活动图层上执行操作
         def draw_transformed_selection(painter):
@@ -705,7 +709,7 @@ class BaseSelectTool(BaseTool):
             painter.restore()
 
         # 3. 调用控制器方法，将绘制操作应用到活动图层
-        self.controller.draw_on_active_layer(draw_transformed_selection, save_history=False)
+        self.controller.draw_on_active_layer(draw_transformed_selection, save_history=True)
 
         # 4. 清理状态，退出浮动模式
         self._cancel_selection()
@@ -769,7 +773,7 @@ class EllipseSelectTool(BaseSelectTool):
         """创建椭圆选区的蒙版"""
         if not self.selection_rect:
             return None
-        mask = QImage(self.selection_rect.size(), QImage.Format.Format_ARGB32)
+        mask = QImage(self.selection_rect.size(), QImage.Format.Format_ARGB32_Premultiplied)
         mask.fill(QColor(0, 0, 0, 0))
         painter = QPainter(mask)
         painter.setBrush(QBrush(QColor(255, 255, 255, 255)))
@@ -791,6 +795,8 @@ class ImprovedPolygonSelectTool(BaseSelectTool):
 
     def mouse_press(self, event, image_pos):
         """重写鼠标按下以处理多边形创建"""
+        # 不一定调用基类，按下前等待中的悬停移动需在此丢弃
+        self._drop_pending_move()
         x, y = int(image_pos.x()), int(image_pos.y())
         
         # 如果已有浮动选区，使用基类的编辑逻辑
@@ -842,11 +848,11 @@ class ImprovedPolygonSelectTool(BaseSelectTool):
                 # 如果没有在创建，则取消
                 self.cancel()
 
-    def mouse_move(self, event, image_pos):
+    def _do_move(self, event, image_pos):
         """重写鼠标移动"""
         if self.is_floating:
             # 如果已有浮动选区，使用基类的移动逻辑
-            super().mouse_move(event, image_pos)
+            super()._do_move(event, image_pos)
             return
         
         if self.is_creating and self.has_first_click:
@@ -969,7 +975,7 @@ class ImprovedPolygonSelectTool(BaseSelectTool):
         self._draw_hint(painter, hint_text)
         painter.end()
 
-        self.controller.temp_pixmap = QPixmap.fromImage(temp_image)
+        self.controller.temp_pixmap = QPixmap.fromImage(temp_image, Qt.ImageConversionFlag.NoFormatConversion)
         if self.controller.canvas:
             self.controller.canvas.update()
 
@@ -993,7 +999,7 @@ class ImprovedPolygonSelectTool(BaseSelectTool):
         if not self.selection_rect or not self.original_points:
             return None
 
-        mask = QImage(self.selection_rect.size(), QImage.Format.Format_ARGB32)
+        mask = QImage(self.selection_rect.size(), QImage.Format.Format_ARGB32_Premultiplied)
         mask.fill(QColor(0, 0, 0, 0))
         painter = QPainter(mask)
         painter.setBrush(QBrush(QColor(255, 255, 255, 255)))
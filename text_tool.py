@@ -368,9 +368,9 @@ class TextTool(BaseTool):
             if self.is_editing:
                 self.commit_text()
                 
-    def mouse_move(self, event, image_pos):
+    def _do_move(self, event, image_pos):
         """鼠标移动"""
-        super().mouse_move(event, image_pos)
+        super()._do_move(event, image_pos)
         
         if not self.is_editing:
             return
@@ -775,11 +775,7 @@ class TextTool(BaseTool):
         if not self.is_editing or not self.text or not self.controller:
             return
         
-        # 保存历史
-        if hasattr(self.controller, 'save_to_history'):
-            self.controller.save_to_history()
-        
-        # 绘制文字到活动图层
+        # 绘制文字到活动图层(draw_on_active_layer 记录历史)
         def draw_text(painter):
             painter.setRenderHint(QPainter.RenderHint.Antialiasing)
             painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
@@ -107,8 +107,10 @@ if USE_OPENGL:
             if not self.controller or not self.controller.current_image:
                 return
             
-            if not self.pixmap or self.pixmap.size() != self.controller.current_image.size():
-                self.pixmap = QPixmap.fromImage(self.controller.current_image)
+            # 合成图像的QPixmap由控制器按内容版本缓存
+            self.pixmap = self.controller.get_composite_pixmap()
+            if self.pixmap is None:
+                return
             
             if self.pixmap.width() <= 0 or self.pixmap.height() <= 0 or self.scale_factor <= 0:
                 return
@@ -160,7 +162,9 @@ if USE_OPENGL:
             if not self.controller or not self.controller.current_image:
                 return
             
-            self.pixmap = QPixmap.fromImage(self.controller.current_image)
+            self.pixmap = self.controller.get_composite_pixmap()
+            if self.pixmap is None:
+                return
             
             if self.pixmap.width() > 0 and self.pixmap.height() > 0:
                 self.scale_factor = min(
@@ -280,8 +284,10 @@ else:
             if not self.controller or not self.controller.current_image:
                 return
             
-            if not self.pixmap or self.pixmap.size() != self.controller.current_image.size():
-                self.pixmap = QPixmap.fromImage(self.controller.current_image)
+            # 合成图像的QPixmap由控制器按内容版本缓存
+            self.pixmap = self.controller.get_composite_pixmap()
+            if self.pixmap is None:
+                return
             
             if self.pixmap.width() <= 0 or self.pixmap.height() <= 0 or self.scale_factor <= 0:
                 return
@@ -333,7 +339,9 @@ else:
             if not self.controller or not self.controller.current_image:
                 return
             
-            self.pixmap = QPixmap.fromImage(self.controller.current_image)
+            self.pixmap = self.controller.get_composite_pixmap()
+            if self.pixmap is None:
+                return
             
             if self.pixmap.width() > 0 and self.pixmap.height() > 0:
                 self.scale_factor = min(